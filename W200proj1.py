@@ -1,79 +1,927 @@
 
+import itertools
+import math
 import random
+import sys
 import time
+from array import array
+from collections import OrderedDict, deque
 
+import slap_metrics
+
+# Importing this module has no side effects: curses and asyncio are only imported (and the terminal only taken
+# over) once Slap.game_start runs, so headless code and worker processes can import the rules cheaply.
 # I read up on the curses library from two main pages: https://www.devdungeon.com/content/curses-programming-python 
 # and https://docs.python.org/3/library/curses.html
-import curses
+
+# Remembers the controls that will be displayed at the bottom of the Window object.
+CONTROLS = "Press d to draw\nPress s to slap\nPress i for instructions\nPress q to quit"
+
+# Remembers how much time (in seconds) a player has to press 's' in order to win a slap event.
+WAIT_TIME = 1
+
+# Kinds of events passed to a SlapEngine's recorder and listeners (see slap_replay and SlapOdds).
+EVENT_DRAW = 1
+EVENT_SLAP = 2
+EVENT_PENALTY = 3
+EVENT_AWARD = 4
+
+# The possible card ranks, lowest to highest. A card's rank code is its position in this tuple.
+RANKS = ("2", "3", "4", "5", "6", "7", "8", "9", "10", "J", "Q", "K", "A")
+RANK_CODES = {rank: code for code, rank in enumerate(RANKS)}
+
+class RandomStream(random.Random):
+    '''A random.Random that can hand out independent child streams, for games and worker processes that must
+        not share (or collide on) random numbers. A stream is named by its entropy (the root seed) and a key, the
+        path of spawn() calls that led to it; the generator is seeded from both, hashed the way random.Random
+        hashes string seeds, so the same entropy and key always give the same numbers in any process. The root
+        stream (an empty key) gives the same numbers as random.Random(entropy). If entropy is None it is drawn
+        from the random module. Streams can be pickled, so they can be sent to worker processes.'''
+
+    def __init__(self, entropy=None, key=()):
+        if entropy is None:
+            entropy = random.getrandbits(63)
+        self.entropy = entropy
+        self.key = tuple(key)
+        self.spawned = 0
+        if self.key:
+            super().__init__(':'.join(str(part) for part in (entropy,) + self.key))
+        else:
+            super().__init__(entropy)
+
+    def spawn(self, n):
+        '''Returns n new child streams. Each call gives different children, in a repeatable order.'''
+        children = [RandomStream(self.entropy, self.key + (self.spawned + i,)) for i in range(n)]
+        self.spawned += n
+        return children
+
+    def __reduce__(self):
+        return (self.__class__, (self.entropy, self.key), (self.getstate(), self.spawned))
+
+    def __setstate__(self, state):
+        random_state, self.spawned = state
+        self.setstate(random_state)
+
+    def __repr__(self):
+        return 'RandomStream({self.entropy!r}, {self.key})'.format(self=self)
+
 
 class PlayingCard:
     ''' Takes a rank as a string. 
-        Creates a playing card with said rank'''
-    
-    def __init__(self, rank):
-        # Checks that the rank given is a possible card value.
-        if rank not in  ["2", "3", "4", "5", "6", "7", "8", "9", "10", "J", "Q", "K", "A"]:
-            raise Exception ('Invalid rank!.')
-            
-        # Assigns the PlayingCard attribute rank.
-        self.rank = rank
-    
+        Creates a playing card with said rank. There is only ever one PlayingCard object per rank: asking for
+        a rank that already exists returns the same object, so a deck of 52 cards only holds references to 13
+        small objects. Each card also has an integer code (its position in RANKS) for fast comparisons.'''
+
+    __slots__ = ('rank', 'code')
+
+    # Remembers the one card made for each rank.
+    _cards = {}
+
+    def __new__(cls, rank):
+        card = cls._cards.get(rank)
+        if card is None:
+            # Checks that the rank given is a possible card value.
+            if rank not in RANK_CODES:
+                raise Exception ('Invalid rank!.')
+
+            # Assigns the PlayingCard attributes rank and code.
+            card = object.__new__(cls)
+            card.rank = rank
+            card.code = RANK_CODES[rank]
+            cls._cards[rank] = card
+        return card
+
+    @staticmethod
+    def from_code(code):
+        '''Returns the card for a rank code.'''
+        return CARDS[code]
+
+    def __reduce__(self):
+        # Pickles the card by rank so unpickling returns the shared card for that rank.
+        return (PlayingCard, (self.rank,))
+
     def __repr__(self):
         # formats the PlayingCard
         return '{self.rank}'.format(self=self)
 
+
+# One card for each rank, indexed by rank code.
+CARDS = tuple(PlayingCard(rank) for rank in RANKS)
+
         
 class Deck:
     '''Creates either a deck with 52 cards with four cards of each rank, or a deck with no cards.
         Contains methods for drawing and adding cards, shuffling the deck, finding cards, and adding cards
-        during a mistaken 'slap' '''
+        during a mistaken 'slap'. The cards are kept in a deque with the top of the deck at index 0, so drawing
+        from the top and adding to either end never has to shift the rest of the cards. '''
 
-    def __init__(self, status= 'full'):
+    def __init__(self, status= 'full', rng=random):
         '''Creates a deck of cards. If no argument is entered, the deck will have 52 cards consisting 
             of four cards for each possible rank. If 'empty' is passed through as an argument, then the deck
-            will start with no cards, but still be able to have cards added later. '''
+            will start with no cards, but still be able to have cards added later. The deck is shuffled with rng
+            (a random.Random or RandomStream), or with the random module if none is given. '''
         if status=='full':
-            deck = []
-            for i in range(4):
-                for rank in ["2", "3", "4", "5", "6", "7", "8", "9", "10", "J", "Q", "K", "A"]:
-                    deck.append(PlayingCard(rank))
+            deck = list(CARDS) * 4
         elif status== 'empty':
             deck = []
             
         #Saves the deck object and shuffles the deck after it is made.
-        self.deck = deck
-        self.shuffle_deck()
+        self.deck = deque(deck)
+        self.shuffle_deck(rng)
 
     def __repr__(self):
-        return '{self.deck}'.format(self=self)
+        return '{}'.format(list(self.deck))
     
-    def shuffle_deck(self):
-        '''Randomly shuffles the cards in a deck.'''
-        random.shuffle(self.deck)
+    def shuffle_deck(self, rng=random):
+        '''Randomly shuffles the cards in a deck. rng can be a random.Random (or RandomStream) to use instead of the
+            random module.'''
+        # Shuffling a list is faster than swapping cards inside the deque, so the cards are shuffled in a list
+        # and put back into the same deque.
+        cards = list(self.deck)
+        rng.shuffle(cards)
+        self.deck.clear()
+        self.deck.extend(cards)
 
     def draw_card(self):
         '''Removes the top card from a deck.'''
         if len(self.deck)>0:
-            return self.deck.pop(0)
+            return self.deck.popleft()
 
     def add_card(self,card):
         #Adds a card to the bottom of a deck.
         self.deck.append(card)
 
+    def add_card_top(self,card):
+        #Adds a card to the top of a deck.
+        self.deck.appendleft(card)
+
+    def extend_bottom(self, cards):
+        '''Adds a group of cards to the bottom of a deck, keeping their order.'''
+        self.deck.extend(cards)
+
+    def burn(self, n):
+        '''Removes up to n cards from the top of a deck and returns them in the order they were drawn.'''
+        deck = self.deck
+        return [deck.popleft() for i in range(min(n, len(deck)))]
+
+    def take_pile(self, pile):
+        '''Moves every card in another deck(pile) to the bottom of this deck and leaves pile empty.'''
+        self.deck.extend(pile.deck)
+        pile.deck.clear()
+
+    def absorb(self, pile, rng=random):
+        '''Picks up a whole pile after a slap: moves every card in pile to this deck, shuffles this deck once,
+            and leaves pile empty so the same Deck object can keep being used as the discard pile.'''
+        self.take_pile(pile)
+        self.shuffle_deck(rng)
+
     def lose_cards(player, discard):
         '''Removes three cards from one deck(player) and adds them to the top of another deck(discard) '''
         #Check if the deck passed is long enough to have three cards removed.
         if len(player.deck)>=3:
-            discard.deck.insert(0,player.deck.pop(0))
-            discard.deck.insert(0,player.deck.pop(0))
-            discard.deck.insert(0,player.deck.pop(0))
+            # extendleft adds the cards one at a time, so the third card removed ends up on top like before.
+            discard.deck.extendleft(player.burn(3))
 
 
     def find_card(self,index):
         '''Defines indexing for a Deck object'''
         return self.deck[index]
 
- 
+    def to_array(self):
+        '''Returns the deck as a compact array of rank codes, top card first.'''
+        return array('b', [card.code for card in self.deck])
+
+    def to_bytes(self):
+        '''Returns the deck as bytes, one rank code per card, top card first.'''
+        return self.to_array().tobytes()
+
+    @classmethod
+    def from_codes(cls, codes):
+        '''Creates a deck from rank codes (an array, bytes or any list of ints), top card first, without shuffling.'''
+        deck = cls('empty')
+        deck.deck.extend([CARDS[code] for code in codes])
+        return deck
+
+
+# Deck operations are timed when metrics are enabled (see slap_metrics).
+slap_metrics.register(Deck, ('shuffle_deck', 'draw_card', 'add_card', 'add_card_top', 'extend_bottom', 'burn',
+                             'take_pile', 'absorb', 'lose_cards'), 'deck')
+
+
+class SlapRule:
+    '''One kind of slap event, described by which cards of the discard pile it looks at and how they have to
+        relate. positions are indexes into the pile: -1 is the top card, -2 the one under it, -3 the one under
+        that, and 0 the bottom card. kind is one of:
+            'same'  all the cards have the same rank (a Double is 'same' at (-1, -2))
+            'pair'  the cards are exactly the ranks in arg, in any order (a Marriage is a K and a Q)
+            'sum'   the cards add up to arg, counting number cards at face value and an A as 1
+            'run'   the cards go up or down by one rank at a time (like 4 5 6 or Q J 10)
+        description says in words when the rule goes off, for the instructions.'''
+
+    KINDS = ('same', 'pair', 'sum', 'run')
+
+    # What each rank counts as for 'sum' rules. J, Q and K don't count.
+    VALUES = {"2": 2, "3": 3, "4": 4, "5": 5, "6": 6, "7": 7, "8": 8, "9": 9, "10": 10, "A": 1}
+
+    def __init__(self, name, kind, positions, arg=None, description=None):
+        if kind not in self.KINDS:
+            raise Exception('Invalid slap rule kind!')
+        self.name = name
+        self.kind = kind
+        self.positions = tuple(positions)
+        self.arg = tuple(arg) if kind == 'pair' else arg
+        self.description = description
+
+    def matches(self, codes):
+        '''Checks the rank codes found at the rule's positions (None where the pile is too small).'''
+        if None in codes:
+            return False
+        if self.kind == 'same':
+            return all(code == codes[0] for code in codes)
+        if self.kind == 'pair':
+            return sorted(RANKS[code] for code in codes) == sorted(self.arg)
+        if self.kind == 'sum':
+            values = [self.VALUES.get(RANKS[code]) for code in codes]
+            return None not in values and sum(values) == self.arg
+        steps = {codes[i + 1] - codes[i] for i in range(len(codes) - 1)}
+        return steps == {1} or steps == {-1}
+
+    def __repr__(self):
+        return 'SlapRule({self.name!r}, {self.kind!r}, {self.positions}, {self.arg!r})'.format(self=self)
+
+
+# Every slap event the game knows, in the order they are checked. When one card sets off more than one rule,
+# only the first one counts.
+HOUSE_RULES = (
+    SlapRule('Double', 'same', (-1, -2), description='two of the same card are placed in a row (ex: 2 2, K K)'),
+    SlapRule('Sandwhich', 'same', (-1, -3),
+             description='the first and third cards on top are the same (ex: 2 5 2, K 7 K)'),
+    SlapRule('Top and Bottom', 'same', (-1, 0), description='the top card is the same as the bottom card of the pile'),
+    SlapRule('Marriage', 'pair', (-1, -2), ('K', 'Q'), description='a K and a Q are placed one after the other'),
+    SlapRule('Tens', 'sum', (-1, -2), 10,
+             description='the top two cards add up to 10, with an A counting as 1 (ex: 3 7, A 9)'),
+    SlapRule('Run', 'run', (-3, -2, -1), description='the top three cards go up or down in order (ex: 4 5 6, Q J 10)'),
+)
+
+# The slap events of the original game.
+DEFAULT_RULES = HOUSE_RULES[:2]
+
+
+class SlapMatcher:
+    '''Finds the slap event (if any) showing on a discard pile, for a list of SlapRules. Rules only look at the
+        top three cards and the bottom card, so when the matcher is made it works out the answer for every
+        possible combination of the cards its rules look at and stores it in a table. Checking a pile is then
+        one table lookup, no matter how many rules there are. Use SlapMatcher.get to share the table between
+        games that use the same rules.'''
+
+    # Rank code used in the table for a position the pile is too small to have.
+    MISSING = len(RANKS)
+    # Table indexes are the rank codes at POSITIONS written as the digits of a number in base BASE, top card first,
+    # so TOP_PLACE is the place value of the top card's digit.
+    BASE = MISSING + 1
+    POSITIONS = (-1, -2, -3, 0)
+    TOP_PLACE = BASE ** (len(POSITIONS) - 1)
+
+    _shared = {}
+
+    def __init__(self, rules=DEFAULT_RULES):
+        self.rules = tuple(rules)
+        used = set()
+        for rule in self.rules:
+            if not set(rule.positions) <= set(self.POSITIONS):
+                raise Exception('Slap rules can only look at positions -1, -2, -3 and 0!')
+            used.update(rule.positions)
+        self.positions = tuple(position for position in self.POSITIONS if position in used)
+        self.names = (None,) + tuple(rule.name for rule in self.rules)
+
+        # Works out, for each rule on its own, which cards at its positions set it off.
+        codes = list(range(len(RANKS))) + [self.MISSING]
+        checks = []
+        for rule in self.rules:
+            hits = set()
+            for cards in itertools.product(codes, repeat=len(rule.positions)):
+                if rule.matches([None if code == self.MISSING else code for code in cards]):
+                    hits.add(cards)
+            checks.append((tuple(self.positions.index(position) for position in rule.positions), hits))
+
+        # Fills a table with one entry for each combination of cards at self.positions (read as the digits of a
+        # number in base BASE), holding 1 + the index of the first rule it sets off, or 0 for none.
+        small = bytearray(len(codes) ** len(self.positions))
+        for index, cards in enumerate(itertools.product(codes, repeat=len(self.positions))):
+            for i, (columns, hits) in enumerate(checks):
+                if tuple([cards[column] for column in columns]) in hits:
+                    small[index] = i + 1
+                    break
+
+        # Spreads it over a table for all four positions, so match can always work out the index the same way.
+        size = self.BASE
+        columns = [self.POSITIONS.index(position) for position in self.positions]
+        table = bytearray(size ** len(self.POSITIONS))
+        for index, cards in enumerate(itertools.product(range(size), repeat=len(self.POSITIONS))):
+            small_index = 0
+            for column in columns:
+                small_index = small_index * size + cards[column]
+            table[index] = small[small_index]
+        self.table = table
+
+    @classmethod
+    def get(cls, rules=DEFAULT_RULES):
+        '''Returns a shared matcher for rules, making it the first time they are asked for.'''
+        rules = tuple(rules)
+        matcher = cls._shared.get(rules)
+        if matcher is None:
+            matcher = cls._shared[rules] = cls(rules)
+        return matcher
+
+    def match(self, pile):
+        '''Returns the name of the slap event showing on pile (the deque of a discard pile Deck), or None.
+            A pile needs at least two cards for any slap event.'''
+        n = len(pile)
+        if n<2:
+            return None
+        third = pile[-3].code if n>2 else self.MISSING
+        base = self.BASE
+        index = ((pile[-1].code * base + pile[-2].code) * base + third) * base + pile[0].code
+        return self.names[self.table[index]]
+
+
+class SlapOdds:
+    '''Counts cards to give the chance that the next card drawn sets off a slap event. It listens to a
+        SlapEngine and keeps how many cards of each rank are still unseen (in the two decks rather than the
+        discard pile). A draw or a wrong slap takes the cards that went onto the pile off the counts, a wrong slap
+        that loses the game takes off the cards the side threw away, and a pile award puts every card back, so
+        each update costs the same however big the pile is.
+
+        The next card is treated as a random unseen card. chance() tries each of the 13 ranks on top of the
+        pile with the engine's SlapMatcher table, so it also works for house rules, and is constant time.
+        next_chance is the chance right now and last_chance is what it was just before the latest draw, which
+        is what a player watching the pile would have expected.'''
+
+    def __init__(self, engine):
+        '''Starts counting from the engine's current discard pile and starts listening to the engine.'''
+        self.pile = engine.discard_pile.deck
+        self.decks = {'player': engine.player.deck, 'computer': engine.computer.deck}
+        self.table = engine.matcher.table
+        self.unseen = [4] * len(RANKS)
+        for card in self.pile:
+            self.unseen[card.code] -= 1
+        self.total = sum(self.unseen)
+        self.next_chance = self.chance()
+        self.last_chance = 0.0
+        engine.listeners.append(self)
+
+    def record(self, kind, side, value=0):
+        if kind == EVENT_DRAW:
+            self.last_chance = self.next_chance
+            self.unseen[value] -= 1
+            self.total -= 1
+        elif kind == EVENT_PENALTY:
+            if value:
+                # The burned cards are now at the bottom of the pile.
+                pile = self.pile
+                for i in range(value):
+                    self.unseen[pile[i].code] -= 1
+                self.total -= value
+            else:
+                # side could not pay and is about to throw away the rest of its deck.
+                deck = self.decks[side]
+                for card in deck:
+                    self.unseen[card.code] -= 1
+                self.total -= len(deck)
+        elif kind == EVENT_AWARD:
+            # The whole pile goes back into a deck, so every card is unseen again.
+            self.unseen = [4] * len(RANKS)
+            self.total = 4 * len(RANKS)
+        else:
+            return
+        self.next_chance = self.chance()
+
+    def chance(self):
+        '''Returns the chance that the next card drawn onto the pile sets off a slap event.'''
+        pile = self.pile
+        n = len(pile)
+        if n<1 or self.total<1:
+            return 0.0
+        # The table index for the pile after a card is added, leaving out the new top card (see SlapMatcher.match).
+        base = SlapMatcher.BASE
+        third = pile[-2].code if n>1 else SlapMatcher.MISSING
+        rest = (pile[-1].code * base + third) * base + pile[0].code
+        table = self.table
+        unseen = self.unseen
+        place = SlapMatcher.TOP_PLACE
+        hits = 0
+        for code in range(len(RANKS)):
+            if table[code * place + rest]:
+                hits += unseen[code]
+        return hits / self.total
+
+    def __repr__(self):
+        return 'SlapOdds(unseen={}, next_chance={:.3f})'.format(dict(zip(RANKS, self.unseen)), self.next_chance)
+
+
+# The prime modulus and the base StateHash uses for its hashes, and where its random keys come from.
+HASH_MODULUS = (1 << 61) - 1
+HASH_BASE = 1000003
+_hash_keys = random.Random('SlapStateHash')
+
+
+class StateHash:
+    '''Keeps a hash of the whole position of a SlapEngine: both decks in order, the discard pile in order, and
+        whose turn it is. It listens to the engine like SlapOdds. Each pile of cards is hashed Zobrist-style as the
+        sum of a random key for each (pile, rank), times BASE to the power of the card's place in the pile, modulo
+        the prime MODULUS, so drawing from the top, adding to the bottom and burning cards under the discard pile
+        each update the hash in constant time. A pickup reshuffles the winner's deck, so that deck is hashed again
+        from scratch the next time key() is called.'''
+
+    MODULUS = HASH_MODULUS
+    BASE = HASH_BASE
+    BASE_INVERSE = pow(HASH_BASE, HASH_MODULUS - 2, HASH_MODULUS)
+    # BASE ** i for every place a card can have.
+    POWERS = tuple(pow(HASH_BASE, i, HASH_MODULUS) for i in range(4 * len(RANKS)))
+
+    # Keys for the cards in each pile and for the computer having the next turn. They come from a fixed seed so
+    # that the same position has the same hash in every process.
+    KEYS = {name: tuple(_hash_keys.getrandbits(60) for rank in RANKS) for name in ('player', 'computer', 'discard')}
+    COMPUTER_TURN = _hash_keys.getrandbits(60)
+
+    def __init__(self, engine):
+        '''Hashes the engine's current position and starts listening to the engine.'''
+        self.decks = {'player': engine.player.deck, 'computer': engine.computer.deck,
+                      'discard': engine.discard_pile.deck}
+        self.hashes = {name: self.hash_cards(name) for name in self.decks}
+        self.dirty = None
+        engine.listeners.append(self)
+
+    def hash_cards(self, name):
+        '''Hashes a pile from scratch.'''
+        keys = self.KEYS[name]
+        powers = self.POWERS
+        return sum(keys[card.code] * powers[i] for i, card in enumerate(self.decks[name])) % self.MODULUS
+
+    def record(self, kind, side, value=0):
+        hashes = self.hashes
+        modulus = self.MODULUS
+        if kind == EVENT_DRAW:
+            # The card left the top of side's deck and is now the top card of the discard pile.
+            hashes[side] = (hashes[side] - self.KEYS[side][value]) * self.BASE_INVERSE % modulus
+            place = len(self.decks['discard']) - 1
+            hashes['discard'] = (hashes['discard'] + self.KEYS['discard'][value] * self.POWERS[place]) % modulus
+        elif kind == EVENT_PENALTY:
+            if value:
+                # The burned cards are at the bottom of the discard pile, the first one burned on top of the others.
+                pile = self.decks['discard']
+                deck_keys = self.KEYS[side]
+                discard_keys = self.KEYS['discard']
+                for i in range(value - 1, -1, -1):
+                    code = pile[i].code
+                    hashes[side] = (hashes[side] - deck_keys[code]) * self.BASE_INVERSE % modulus
+                    hashes['discard'] = (hashes['discard'] * self.BASE + discard_keys[code]) % modulus
+            else:
+                self.dirty = side
+        elif kind == EVENT_AWARD:
+            # The pile has been shuffled into side's deck.
+            self.dirty = side
+            hashes['discard'] = 0
+
+    def key(self, player_turn):
+        '''Returns the hash of the position, with player_turn saying whose turn is next.'''
+        if self.dirty is not None:
+            self.hashes[self.dirty] = self.hash_cards(self.dirty)
+            self.dirty = None
+        hashes = self.hashes
+        key = hashes['player'] + hashes['computer'] + hashes['discard']
+        if not player_turn:
+            key += self.COMPUTER_TURN
+        return key % self.MODULUS
+
+
+class SeenStates:
+    '''Remembers the last size position hashes seen, forgetting the oldest first. seen() both checks for and
+        adds a hash in constant time.'''
+
+    def __init__(self, size=4096):
+        self.size = size
+        self.states = OrderedDict()
+
+    def seen(self, key):
+        '''Returns True if key is one of the remembered hashes, and remembers it as the newest either way.'''
+        states = self.states
+        if key in states:
+            states.move_to_end(key)
+            return True
+        states[key] = None
+        if len(states)>self.size:
+            states.popitem(last=False)
+        return False
+
+    def __len__(self):
+        return len(self.states)
+
+
+class RepeatedPosition(Exception):
+    '''Raised by a SlapEngine with on_repeat='abort' when a position comes back.'''
+
+
+class SlapPolicy:
+    '''Decides how one side of a headless game behaves. The base policy never slaps. Subclasses override
+        slap_time to say how fast they slap a slap event, and false_slap to say if they slap when there is
+        no slap event. Policies make their random choices with engine.policy_rng. A policy with uses_odds set
+        gets a SlapOdds on engine.odds.'''
+
+    uses_odds = False
+
+    def slap_time(self, engine, event):
+        '''Returns how many seconds after the card lands this side slaps the pile, or None if it does not slap.'''
+        return None
+
+    def false_slap(self, engine):
+        '''Returns True if this side slaps the pile at the start of its turn even though there is no slap event.'''
+        return False
+
+    def __repr__(self):
+        return type(self).__name__ + '()'
+
+
+class ComputerPolicy(SlapPolicy):
+    '''The computer from the terminal game. It never misses, and it slaps exactly when the wait time runs out,
+        so the other side only wins a slap by being faster than the wait time.'''
+
+    def slap_time(self, engine, event):
+        return engine.wait_time
+
+
+class FixedReactionPolicy(SlapPolicy):
+    '''Always slaps a slap event after the same number of seconds.'''
+
+    def __init__(self, reaction):
+        self.reaction = reaction
+
+    def slap_time(self, engine, event):
+        return self.reaction
+
+    def __repr__(self):
+        return 'FixedReactionPolicy({self.reaction})'.format(self=self)
+
+
+class RandomReactionPolicy(SlapPolicy):
+    '''Slaps a slap event after a random number of seconds between low and high. It misses a slap event
+        with probability miss_rate, and slaps at the wrong time with probability false_slap_rate per turn.'''
+
+    def __init__(self, low, high, miss_rate=0.0, false_slap_rate=0.0):
+        self.low = low
+        self.high = high
+        self.miss_rate = miss_rate
+        self.false_slap_rate = false_slap_rate
+
+    def slap_time(self, engine, event):
+        if self.miss_rate and engine.policy_rng.random() < self.miss_rate:
+            return None
+        return engine.policy_rng.uniform(self.low, self.high)
+
+    def false_slap(self, engine):
+        return bool(self.false_slap_rate) and engine.policy_rng.random() < self.false_slap_rate
+
+    def __repr__(self):
+        return 'RandomReactionPolicy({self.low}, {self.high}, {self.miss_rate}, {self.false_slap_rate})'.format(self=self)
+
+
+class ReactionTimePolicy(SlapPolicy):
+    '''A computer opponent with a human-like reaction time. Reaction times are drawn from a 'normal' or
+        'lognormal' distribution with the given mean and standard deviation (in seconds) and are never faster
+        than min_reaction. It misses a slap event with probability miss_rate, and slaps at the wrong time with
+        probability false_slap_rate per turn.'''
+
+    def __init__(self, mean, sd, miss_rate=0.0, false_slap_rate=0.0, distribution='normal', min_reaction=0.1):
+        if distribution not in ('normal', 'lognormal'):
+            raise Exception('Invalid distribution!')
+        self.mean = mean
+        self.sd = sd
+        self.miss_rate = miss_rate
+        self.false_slap_rate = false_slap_rate
+        self.distribution = distribution
+        self.min_reaction = min_reaction
+
+        # Converts the mean and standard deviation to the parameters of the underlying normal distribution.
+        if distribution == 'lognormal':
+            variance = math.log(1 + (sd / mean) ** 2)
+            self._mu = math.log(mean) - variance / 2
+            self._sigma = math.sqrt(variance)
+
+    def slap_time(self, engine, event):
+        rng = engine.policy_rng
+        if self.miss_rate and rng.random() < self.miss_rate:
+            return None
+        if self.distribution == 'normal':
+            reaction = rng.gauss(self.mean, self.sd)
+        else:
+            reaction = rng.lognormvariate(self._mu, self._sigma)
+        return max(reaction, self.min_reaction)
+
+    def false_slap(self, engine):
+        return bool(self.false_slap_rate) and engine.policy_rng.random() < self.false_slap_rate
+
+    def __repr__(self):
+        return ('ReactionTimePolicy({self.mean}, {self.sd}, {self.miss_rate}, {self.false_slap_rate}, '
+                '{self.distribution!r})').format(self=self)
+
+
+class CardCountingPolicy(ReactionTimePolicy):
+    '''A ReactionTimePolicy that counts cards. The likelier a slap event was before the card landed (see
+        SlapOdds), the readier it is to slap: up to prearm seconds come off its reaction time when a slap event
+        was certain. It is still never faster than min_reaction.'''
+
+    uses_odds = True
+
+    def __init__(self, mean, sd, prearm=0.2, miss_rate=0.0, false_slap_rate=0.0, distribution='normal',
+                 min_reaction=0.1):
+        super().__init__(mean, sd, miss_rate, false_slap_rate, distribution, min_reaction)
+        self.prearm = prearm
+
+    def slap_time(self, engine, event):
+        reaction = super().slap_time(engine, event)
+        if reaction is None:
+            return None
+        return max(reaction - self.prearm * engine.odds.last_chance, self.min_reaction)
+
+    def __repr__(self):
+        return ('CardCountingPolicy({self.mean}, {self.sd}, {self.prearm}, {self.miss_rate}, {self.false_slap_rate}, '
+                '{self.distribution!r})').format(self=self)
+
+
+class SlapEngine:
+    '''The rules of Slap without the terminal. It deals two decks of 26 cards from a shuffled 52 card deck and
+        lets the 'player' and the 'computer' take turns adding cards to the discard pile. After every card it
+        checks the pile once against rules (a list of SlapRules, by default a Double event where the top two
+        cards match and a Sandwhich event where the first and third cards match). The pile goes to whichever
+        side slaps first within the wait time; if both slap at the same moment the computer wins, like in the
+        terminal game. Slapping when there is no slap event costs
+        three cards, or the game if the side has fewer than three. The loser is whoever runs out of cards first.
+        Both sides are driven by SlapPolicy objects.
+
+        Every game has a seed. The cards are dealt and shuffled with rng, a random.Random made from the seed,
+        and the policies use their own policy_rng, so the cards in a game only depend on the seed and on what
+        happened, not on how the policies made their choices. That is what lets a recorded game be replayed
+        from its seed and its events. A seed is a whole number from 0 to MAX_SEED, the largest a recording can
+        store. If no seed is given, one is drawn from rng (for example one RandomStream per worker) or from the
+        random module.
+        If a recorder is given, every draw, slap, wrong slap and pile award is passed to recorder.record, and
+        the same goes for anything else added to listeners. If odds is True, or a policy asks for it, the engine
+        keeps a SlapOdds on odds (otherwise odds is None).
+
+        Games of Slap can go on for a very long time. If on_repeat is given, the engine keeps a StateHash of the
+        position and remembers the last history_size positions in a SeenStates, and when a position comes back
+        after a turn it counts it in repeats and then, depending on on_repeat:
+            'draw'   stops the game as a draw (drawn becomes True and there is no winner)
+            'abort'  raises RepeatedPosition
+            'count'  only counts it and carries on'''
+
+    REPEAT_POLICIES = ('draw', 'abort', 'count')
+
+    # The largest seed, so that every game's seed fits in a recording header (see slap_replay).
+    MAX_SEED = 2 ** 64 - 1
+
+    SIDES = ('player', 'computer')
+
+    def __init__(self, player_policy=None, computer_policy=None, wait_time=WAIT_TIME, rng=None, seed=None,
+                 recorder=None, rules=DEFAULT_RULES, odds=False, on_repeat=None, history_size=4096):
+        '''Deals the decks. If no policies are given, the player never slaps and the computer plays like the
+            terminal game's computer.'''
+        if seed is None:
+            seed = (rng or random).getrandbits(63)
+        elif not isinstance(seed, int) or not 0 <= seed <= self.MAX_SEED:
+            raise Exception('Invalid seed! Seeds are whole numbers from 0 to {}.'.format(self.MAX_SEED))
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.policy_rng = random.Random(self.rng.getrandbits(64))
+        self.wait_time = wait_time
+        self.recorder = recorder
+        self.listeners = [recorder] if recorder is not None else []
+        self.matcher = SlapMatcher.get(rules)
+        self.policies = {'player': player_policy or SlapPolicy(),
+                         'computer': computer_policy or ComputerPolicy()}
+
+        # Builds the full deck in a fixed order and shuffles it with the engine's rng so the deal can be
+        # repeated from a seed.
+        deck = Deck('empty')
+        deck.extend_bottom(CARDS * 4)
+        deck.shuffle_deck(self.rng)
+        self.discard_pile = Deck('empty')
+        self.player = Deck('empty')
+        self.computer = Deck('empty')
+        while len(deck.deck)>0:
+            self.player.add_card(deck.draw_card())
+            self.computer.add_card(deck.draw_card())
+
+        # Game state and counters.
+        self.player_turn = True
+        self.winner = None
+        self.turns = 0
+        self.slaps = {'player': 0, 'computer': 0}
+        self.wrong_slaps = {'player': 0, 'computer': 0}
+        self.repeats = 0
+        self.drawn = False
+
+        if odds or any(policy.uses_odds for policy in self.policies.values()):
+            self.odds = SlapOdds(self)
+        else:
+            self.odds = None
+
+        # Remembers the starting position so coming back to it counts as a repeat.
+        if on_repeat is not None and on_repeat not in self.REPEAT_POLICIES:
+            raise Exception('Invalid repeat policy!')
+        self.on_repeat = on_repeat
+        if on_repeat is not None:
+            self.state_hash = StateHash(self)
+            self.history = SeenStates(history_size)
+            self.history.seen(self.state_hash.key(self.player_turn))
+        else:
+            self.state_hash = None
+            self.history = None
+
+    def notify(self, kind, side, value=0):
+        '''Passes an event to every listener.'''
+        for listener in self.listeners:
+            listener.record(kind, side, value)
+
+    def deck_of(self, side):
+        '''Returns the Deck that belongs to side ('player' or 'computer').'''
+        return self.player if side == 'player' else self.computer
+
+    def other(self, side):
+        '''Returns the side that is not side.'''
+        return 'computer' if side == 'player' else 'player'
+
+    def current_side(self):
+        '''Returns the side whose turn it is.'''
+        return 'player' if self.player_turn else 'computer'
+
+    def draw(self, side):
+        '''Adds the top card of side's deck to the discard pile and returns it.'''
+        card = self.deck_of(side).draw_card()
+        self.discard_pile.add_card(card)
+        if self.listeners:
+            self.notify(EVENT_DRAW, side, card.code)
+        return card
+
+    def slap_event(self):
+        '''Returns the name of the slap event the discard pile is showing (like 'Double'), otherwise None.'''
+        return self.matcher.match(self.discard_pile.deck)
+
+    def award_pile(self, side, reaction=None):
+        '''Adds the whole discard pile to side's deck, shuffles that deck, and empties the discard pile.
+            reaction is how many seconds side took to slap, if known; it is only used for recording.'''
+        size = len(self.discard_pile.deck)
+        self.deck_of(side).absorb(self.discard_pile, self.rng)
+        self.slaps[side] += 1
+        # Listeners hear about the award once the pile is empty and side's deck has been shuffled.
+        if self.listeners:
+            if reaction is not None:
+                self.notify(EVENT_SLAP, side, min(int(reaction * 1000), 65535))
+            self.notify(EVENT_AWARD, side, size)
+
+    def wrong_slap(self, side):
+        '''Applies the penalty for slapping when there is no slap event. Returns True if side lost three cards
+            to the bottom of the discard pile, or False if side did not have three cards and has lost the game.'''
+        deck = self.deck_of(side)
+        self.wrong_slaps[side] += 1
+        if len(deck.deck)>=3:
+            Deck.lose_cards(deck, self.discard_pile)
+            if self.listeners:
+                self.notify(EVENT_PENALTY, side, 3)
+            return True
+        if self.listeners:
+            self.notify(EVENT_PENALTY, side, 0)
+        deck.deck.clear()
+        self.winner = self.other(side)
+        return False
+
+    def check_repeat(self):
+        '''Checks the position at the start of a turn against the positions seen before and applies on_repeat.
+            Returns True if the game has been stopped as a draw.'''
+        if self.state_hash is None or not self.history.seen(self.state_hash.key(self.player_turn)):
+            return False
+        self.repeats += 1
+        if self.on_repeat == 'abort':
+            raise RepeatedPosition('Position repeated after {} turns.'.format(self.turns))
+        if self.on_repeat == 'draw':
+            self.drawn = True
+            return True
+        return False
+
+    def resolve_slap(self, event):
+        '''Asks both policies how fast they slap event and returns (side that wins the pile, its slap time),
+            or (None, None) if nobody slapped within the wait time.'''
+        best_side = None
+        best_time = None
+        # The computer is asked last so that it wins ties.
+        for side in self.SIDES:
+            slap_time = self.policies[side].slap_time(self, event)
+            if slap_time is None or slap_time>self.wait_time:
+                continue
+            if best_time is None or slap_time<=best_time:
+                best_side = side
+                best_time = slap_time
+        return best_side, best_time
+
+    def step(self):
+        '''Plays one turn for the side whose turn it is. Returns the slap event the turn caused, if any.'''
+        side = self.current_side()
+        deck = self.deck_of(side)
+
+        # Whoever has no cards at the start of their turn has lost.
+        if len(deck.deck)<1:
+            self.winner = self.other(side)
+            return None
+
+        # A slap at the wrong time costs cards before the side draws.
+        if self.policies[side].false_slap(self):
+            if not self.wrong_slap(side) or len(deck.deck)<1:
+                self.winner = self.other(side)
+                return None
+
+        self.draw(side)
+        self.turns += 1
+
+        event = self.matcher.match(self.discard_pile.deck)
+        if event is not None:
+            slapper, slap_time = self.resolve_slap(event)
+            if slapper is not None:
+                self.award_pile(slapper, slap_time)
+
+        self.player_turn = not self.player_turn
+        if self.state_hash is not None:
+            self.check_repeat()
+        return event
+
+    def play(self, max_turns=None):
+        '''Plays turns until somebody wins, the game is drawn, or max_turns cards have been drawn. Returns the
+            winning side, or None if the game was drawn or stopped early.'''
+        while self.winner is None and not self.drawn:
+            if max_turns is not None and self.turns>=max_turns:
+                break
+            self.step()
+        return self.winner
+
+
+slap_metrics.register(SlapEngine, ('step',), 'engine')
+
+
+class SimulationResult:
+    '''Totals from a batch of headless games played by simulate().'''
+
+    def __init__(self):
+        self.games = 0
+        self.wins = {'player': 0, 'computer': 0}
+        self.unfinished = 0
+        self.drawn = 0
+        self.turns = 0
+        self.slaps = {'player': 0, 'computer': 0}
+        self.wrong_slaps = {'player': 0, 'computer': 0}
+
+    def add(self, engine):
+        '''Adds the totals of one finished (or stopped) game.'''
+        self.games += 1
+        if engine.drawn:
+            self.drawn += 1
+        elif engine.winner is None:
+            self.unfinished += 1
+        else:
+            self.wins[engine.winner] += 1
+        self.turns += engine.turns
+        for side in SlapEngine.SIDES:
+            self.slaps[side] += engine.slaps[side]
+            self.wrong_slaps[side] += engine.wrong_slaps[side]
+
+    def win_rate(self, side='player'):
+        '''Returns the fraction of games that side won.'''
+        return self.wins[side] / self.games if self.games else 0.0
+
+    def __repr__(self):
+        return ('SimulationResult(games={self.games}, wins={self.wins}, unfinished={self.unfinished}, '
+                'drawn={self.drawn}, turns={self.turns}, slaps={self.slaps}, wrong_slaps={self.wrong_slaps})').format(self=self)
+
+
+def simulate(n_games, seed=None, player_policy=None, computer_policy=None, wait_time=WAIT_TIME, max_turns=10000,
+             corpus=None, rules=DEFAULT_RULES, on_repeat=None):
+    '''Plays n_games headless games one after another and returns a SimulationResult. The same seed always
+        gives the same result. Games that last longer than max_turns draws are stopped and counted as unfinished.
+        seed can also be a random.Random (like a RandomStream spawned for a worker) to draw the games' seeds from.
+        If corpus (a slap_replay.RecordingWriter) is given, every game is recorded into it. rules are the slap
+        events to play with (see HOUSE_RULES). on_repeat says what to do when a game comes back to a position
+        (see SlapEngine); drawn games are counted in drawn.'''
+    rng = seed if isinstance(seed, random.Random) else random.Random(seed)
+    result = SimulationResult()
+    for i in range(n_games):
+        recorder = corpus.new_recorder() if corpus is not None else None
+        engine = SlapEngine(player_policy, computer_policy, wait_time, rng, recorder=recorder, rules=rules,
+                            on_repeat=on_repeat)
+        engine.play(max_turns)
+        result.add(engine)
+        if corpus is not None:
+            corpus.write(recorder, engine)
+    return result
+
+
 
 class Board:
     '''Creates a string to represent the game's board. The object needs three Deck objects and a 
@@ -99,13 +947,88 @@ class Board:
         return self.board
 
 
+slap_metrics.register(Board, ('__init__',), 'board')
+
+
+class Renderer:
+    '''Draws the game board on a curses screen without clearing and repainting the whole terminal every move.
+        The screen is split into fixed regions laid out like Board (the computer's count, the top card, the
+        player's count, an optional hint line, the controls, then a message line). Each region remembers what it
+        last showed and is only rewritten when its text changes, and all the regions changed by one call are sent
+        to the terminal together with a single curses.doupdate(). update can be given to use something else in
+        place of curses.doupdate (a screen that is not a real curses window, for example).'''
+
+    # The row each region starts on.
+    COMPUTER_ROW = 0
+    TOP_CARD_ROW = 1
+    PLAYER_ROW = 2
+    HINT_ROW = 3
+    CONTROLS_ROW = 4
+    MESSAGE_ROW = CONTROLS_ROW + CONTROLS.count('\n') + 2
+
+    def __init__(self, screen, controls=CONTROLS, update=None):
+        if update is None:
+            import curses
+            update = curses.doupdate
+        self.screen = screen
+        self.controls = controls
+        self.update = update
+        self.regions = {}
+
+    def invalidate(self):
+        '''Forgets what is on the screen so the next draw rewrites every region. Used after something else
+            (like the instructions) has drawn over the board.'''
+        self.regions = {}
+
+    def set_region(self, row, text, to_bottom=False):
+        '''Writes text starting at row if it is different from what the region shows now. Regions that can
+            wrap onto more than one line (the message) are cleared to the bottom of the screen first.'''
+        if self.regions.get(row) == text:
+            return
+        self.screen.move(row, 0)
+        if to_bottom:
+            self.screen.clrtobot()
+        else:
+            self.screen.clrtoeol()
+        self.screen.addstr(row, 0, text)
+        self.regions[row] = text
+
+    def draw(self, discard_pile, comp, play, message='', hint=''):
+        '''Updates the board and message regions that changed and shows them with one screen update. hint is
+            shown on the blank line between the player's count and the controls.'''
+        if len(discard_pile.deck)>0:
+            top_card = str(Deck.find_card(discard_pile,-1))
+        else:
+            top_card = ''
+        self.set_region(self.COMPUTER_ROW, '🃏 computer ' + str(len(comp.deck)))
+        self.set_region(self.TOP_CARD_ROW, top_card)
+        self.set_region(self.PLAYER_ROW, '🃏 you ' + str(len(play.deck)))
+        self.set_region(self.HINT_ROW, hint)
+        self.set_region(self.CONTROLS_ROW, self.controls)
+        self.set_region(self.MESSAGE_ROW, message, to_bottom=True)
+        self.flush()
+
+    def show_message(self, message):
+        '''Replaces only the message line.'''
+        self.set_region(self.MESSAGE_ROW, message, to_bottom=True)
+        self.flush()
+
+    def flush(self):
+        '''Sends every region changed since the last flush to the terminal in one update.'''
+        self.screen.noutrefresh()
+        self.update()
+
+
+slap_metrics.register(Renderer, ('draw', 'show_message', 'flush'), 'render')
+
+
 class Instructions:
     '''Creates and displays the instructions for the game. Because the window object was having formatting issues displaying one string, 
         I decided to display them line by line through a loop.'''
 
-    def __init__(self, screen):
+    def __init__(self, screen, rules=DEFAULT_RULES):
         '''The Instructions are displayed via the object each time it is called. It takes as an argument the screen the instructions
-            will be displayed on.'''
+            will be displayed on, and the slap rules in play so that any extra slap events are explained as well.'''
         instructions = ["Instructions:\n","There are two players, you and the computer.\n", 
                                 "Each player starts with 26 cards from a randomly shuffled 52 card deck.\n",
                                 "You will see two cards representing each player and the number of remaining cards each player has left.\n", 
@@ -119,6 +1042,18 @@ class Instructions:
                                 "Don't press s outside of a slap event, otherwise you will lose three cards from your deck.",
                                 "Note: make sure you check the number of cards in each persons deck, because that tells you if another card was added,\n even if the top card does not change.\n",
                                 "To quit early press q. To see the instructions again, press i.\n\n"]
+
+        # Explains the slap events the house rules add, right after the one every game has.
+        extra = [rule for rule in rules if rule not in DEFAULT_RULES]
+        if extra:
+            lines = ["These house rules are in play, so it is also a slap event when:\n"]
+            for rule in extra:
+                if rule.description is None:
+                    lines.append("  {}\n".format(rule.name))
+                else:
+                    lines.append("  {}: {}.\n".format(rule.name, rule.description))
+            position = next(i for i, line in enumerate(instructions) if line.startswith('If two of the same card')) + 1
+            instructions[position:position] = lines
         self.instructions = instructions
         self.screen = screen
 
@@ -134,315 +1069,393 @@ class Slap:
         press d to draw a card from their own deck and add it to the discard pile. The player and the computer will each add cards to the discard
         pile one after another and the board will continually be updated to show the top card on the discard pile as well as the amount of cards 
         the computer and the player each have. Occasionally there will be a slap event where the player will press the s key as fast as they can
-        . If they press the s key within two seconds, the discard pile is added into the player's deck and the player's deck is reshuffled.
+        . If they press the s key before the computer slaps, the discard pile is added into the player's deck and the player's deck is reshuffled.
         If not, then the discard pile is added to the computer's deck. The loser is the first person to run put of cards. A slap event is triggered 
         when the top two cards on the discard pile are the same (ex: 2 2, K K), called a Double event, or when the first and third cards on top of
         the discard pile are the same (ex: 2 5 2, K 7 K ), called a Sandwhich event. After an event occurs, messages will appear on screen to 
         let the player know the result. If the player slaps when it is not a slap event, then the player loses 3 cards to the discard pile.
         If the player presses i, the instructions will be displayed. If the the player presses q, they will quit the game early. If other keys are 
         pressed, messages will appear to help the player. When the game is finished or comleted, the window will close and print out a message
-        for the player.'''
+        for the player.
 
-    def __init__(self):
-        '''Creates the player's deck, the computer's deck, and the discard pile.'''
-        #Initializes decks.
-        deck = Deck()
-        discard_pile = Deck('empty')
-        player = Deck('empty')
-        computer= Deck('empty')
-        
-        #Fills the player deck and the computer's deck.
-        while len(deck.deck)>0:
-            player.add_card(deck.draw_card())
-            computer.add_card(deck.draw_card())
+        The rules themselves are played by a SlapEngine. The game runs on an asyncio event loop: key presses are read without blocking as
+        soon as the terminal has them and are timestamped with time.perf_counter_ns, and every slap event is a race between the player's
+        key press and the computer's slap timer, so a slap event always ends on time even if no key is pressed. How fast the computer
+        slaps comes from computer_policy (a SlapPolicy); by default it slaps when WAIT_TIME runs out, like it always has.'''
+
+    # How long (in seconds) the board stays up after the player's and the computer's turns. Done by trial and error.
+    PLAYER_PAUSE = 0.6
+    COMPUTER_PAUSE = 0.5
+    # Extra pause after the computer wins a Sandwhich. Not neccesary everywhere.
+    SANDWHICH_PAUSE = 0.1
+
+    def __init__(self, computer_policy=None, record_path=None, metrics_path=None, rules=DEFAULT_RULES,
+                 show_odds=False, max_turns=None, on_repeat=None, seed=None):
+        '''Creates the player's deck, the computer's deck, and the discard pile. If record_path is given, the game
+            is recorded and appended to that recordings file when it ends (see slap_replay). If metrics_path is
+            given, timings are collected during the game and written there (JSON, or CSV for a .csv path).
+            rules are the slap events in play (see HOUSE_RULES). If show_odds is True, the board shows the chance
+            that the next card sets off a slap event (see SlapOdds). The game ends in a draw after max_turns cards
+            have been drawn, or when a position repeats with on_repeat='draw' (see SlapEngine). The same seed
+            always deals the same cards and shuffles every pickup the same way; by default a new one is drawn.'''
+        self.show_odds = show_odds
+        self.max_turns = max_turns
+        self.record_path = record_path
+        self.metrics_path = metrics_path
+        recorder = None
+        if record_path is not None:
+            from slap_replay import GameRecorder
+            recorder = GameRecorder()
+
+        # Deals the decks.
+        engine = SlapEngine(computer_policy=computer_policy, seed=seed, recorder=recorder, rules=rules,
+                            odds=show_odds, on_repeat=on_repeat)
 
         #Saves the decks.
-        self.deck = deck
-        self.discard_pile = discard_pile
-        self.player = player
-        self.computer = computer
-        self.screen = curses.initscr()
-        self.instructions = Instructions(self.screen)
+        self.engine = engine
+        self.discard_pile = engine.discard_pile
+        self.player = engine.player
+        self.computer = engine.computer
+        # The window is opened by game_start.
+        self.screen = None
 
     def game_start(self):
         '''Starts the game and the user interface'''
+        import asyncio
+        import curses
+
+        screen = self.screen = curses.initscr()
+        self.instructions = Instructions(screen, self.engine.matcher.rules)
+        self.renderer = Renderer(screen, update=curses.doupdate)
+        try:
+            event = self.run_session(asyncio, curses)
+        finally:
+            # Closes the window/game, even if something went wrong, so the terminal is usable again.
+            curses.endwin()
+        print(event)
 
-        #To make the code less wordy, assigning the different deck's names here so I can write 'self' less.
-        discard_pile = self.discard_pile
-        player = self.player
-        computer = self.computer
+    def run_session(self, asyncio, curses):
+        '''Runs everything that happens inside the window and returns the message to print when it closes.'''
         screen = self.screen
-        instructions = self.instructions
 
         # Turns off echo so that player's key presses aren't displayed.
         curses.noecho()
         # Turns on cbreak so that the player does not need to hit enter when playing.
         curses.cbreak()
 
-        # Remembers the controls that will be displayed at the bottom of the Window object.
-        CONTROLS = "Press d to draw\nPress s to slap\nPress i for instructions\nPress q to quit"
-
-        # Remembers how much time a player has to press 's' in order to win a slap event
-        WAIT_TIME = 1
-
-        # Declares the variables for remembering whose turn it is and if the game is ongoing.
-        gameon = True
-        player_turn = True
-
-
         # Asks player to press a key to start. 
         screen.addstr('Ready to start? Press any key to begin\n')
         curses.napms(700)
-        c = screen.getch()
+        screen.getch()
 
         # Shows the instructions.
         screen.clear()
-        instructions.display_instructions()
+        self.instructions.display_instructions()
         screen.addstr('Press any key to continue.')
         screen.refresh()
         screen.getch()
 
+        # Plays the game until it ends or the player quits.
+        if self.metrics_path is not None:
+            slap_metrics.enable()
+        event = asyncio.run(self.play())
+        if self.metrics_path is not None:
+            slap_metrics.disable().dump(self.metrics_path)
+
+        # Saves the recording of the game.
+        if self.record_path is not None:
+            from slap_replay import RecordingWriter
+            with RecordingWriter(self.record_path) as corpus:
+                corpus.write(self.engine.recorder, self.engine)
+        return event
+
+    def read_keys(self):
+        '''Called by the event loop whenever the terminal has input. Queues every waiting key together with the time it was read.'''
+        stamp = time.perf_counter_ns()
+        c = self.screen.getch()
+        while c != -1:
+            self.keys.put_nowait((c, stamp))
+            c = self.screen.getch()
+
+    async def next_key(self, deadline=None):
+        '''Waits for the next key press and returns (key, time read in ns). If deadline (a perf_counter_ns time) passes
+            first, returns (None, None).'''
+        import asyncio
+        if deadline is None:
+            return await self.keys.get()
+        timeout = (deadline - time.perf_counter_ns()) / 1e9
+        if timeout <= 0:
+            if self.keys.empty():
+                return None, None
+            return self.keys.get_nowait()
+        try:
+            return await asyncio.wait_for(self.keys.get(), timeout)
+        except asyncio.TimeoutError:
+            return None, None
+
+    def put_back(self, keys):
+        '''Puts (key, time read) pairs back at the front of the key queue, ahead of any keys still waiting.'''
+        if not keys:
+            return
+        waiting = []
+        while not self.keys.empty():
+            waiting.append(self.keys.get_nowait())
+        for key in keys + waiting:
+            self.keys.put_nowait(key)
+
+    def show(self, message=''):
+        '''Draws the board with an optional message under it.'''
+        hint = ''
+        if self.show_odds:
+            hint = 'Chance the next card is a slap event: {:.0%}'.format(self.engine.odds.next_chance)
+        self.renderer.draw(self.discard_pile, self.computer, self.player, message, hint)
+
+    async def play(self):
+        '''Runs the game loop. Returns the message to print when the window closes.'''
+        import asyncio
+        engine = self.engine
+        screen = self.screen
+        loop = asyncio.get_running_loop()
+
+        # Reads keys without blocking, as soon as the terminal has them.
+        self.keys = asyncio.Queue()
+        # s keys read before this perf_counter_ns time were aimed at a slap event that has already been decided.
+        self.late_until = 0
+        screen.nodelay(True)
+        loop.add_reader(sys.stdin.fileno(), self.read_keys)
+        self.read_keys()
 
         # Displays the initial game board on the screen.
         screen.clear()
-        screen.addstr(Board(discard_pile,computer,player, CONTROLS).board)
-        screen.refresh()
+        self.renderer.invalidate()
+        self.show()
+
+        try:
+            while True:
+                # The player's turn. Checks if the player has any cards left in their deck. If not, then the player lost.
+                if len(self.player.deck)<1:
+                    engine.winner = 'computer'
+                if engine.winner is not None:
+                    return self.result()
+                if not await self.player_turn():
+                    return 'You exited early'
+                await self.pause(self.PLAYER_PAUSE)
+                metrics = slap_metrics.active
+                if metrics is not None:
+                    metrics.observe('turn.player', time.perf_counter_ns() - self.turn_started)
+                # A game lost to a wrong slap is over before it can be a draw.
+                if engine.winner is not None:
+                    return self.result()
+                if self.end_turn(False):
+                    return 'The game is a draw'
+
+                # The computer's turn. Checks if the computer has no more cards and therefore the player has won.
+                if len(self.computer.deck)<1:
+                    engine.winner = 'player'
+                if engine.winner is not None:
+                    return self.result()
+                self.turn_started = time.perf_counter_ns()
+                if not await self.computer_turn():
+                    return 'You exited early'
+                await self.pause(self.COMPUTER_PAUSE)
+                metrics = slap_metrics.active
+                if metrics is not None:
+                    metrics.observe('turn.computer', time.perf_counter_ns() - self.turn_started)
+                if self.end_turn(True):
+                    return 'The game is a draw'
+        finally:
+            loop.remove_reader(sys.stdin.fileno())
+            screen.nodelay(False)
+
+    def result(self):
+        '''Returns the message to print for a game that engine.winner has been set for.'''
+        if self.engine.winner == 'player':
+            return 'Congrats player, you won'
+        return 'Sorry player, you lost'
+
+    def end_turn(self, player_turn):
+        '''Hands the turn to the player if player_turn is True, otherwise to the computer. Returns True (and sets
+            engine.drawn) if the game is now a draw, because max_turns cards have been drawn or the position
+            repeated (see SlapEngine).'''
+        engine = self.engine
+        engine.player_turn = player_turn
+        if self.max_turns is not None and engine.turns>=self.max_turns:
+            engine.drawn = True
+            return True
+        return engine.check_repeat()
+
+    async def player_turn(self):
+        '''Waits for the player to draw a card. Returns False if the player quits.'''
+        engine = self.engine
+        while True:
+            c, stamp = await self.next_key()
+
+            #If the the player presses 'i', the window will be cleared and will pull up the instructions
+            if c == ord('i'):
+                self.screen.clear()
+                self.instructions.display_instructions()
+                self.screen.addstr('Press q to quit. Press any other key to continue game')
+                self.screen.refresh()
 
-        # Saves the display message for the player if they exit the game early. If the game is completed, the message will be updated later on.
-        event = 'You exited early'
-
-        # Starts a loop that terminates when the game is over. 
-        while gameon:
-
-            # This loop runs when it is the player's turn i.e. when player_turn == True
-            while player_turn:
-
-                # Checks if the player has any cards left in their deck. If not, then the player lost.
-                if len(player.deck)<1:
-                    gameon = False # Changes flag to tell that the game is over
-                    event = 'Sorry player, you lost' # Changes the final messge to the player
-                    break 
-
-                #Asks the player to press any key.
-                c = screen.getch()
-
-                #If the the player presses 'i', the window will be cleared and will pull up the instructions
-                if c == ord('i'):
-                    # Clears the window and displays the instructions
-                    screen.clear()
-                    instructions.display_instructions()
-                    # Instructions(screen)
-                    screen.addstr('Press q to quit. Press any other key to continue game')
-
-                    # If the player presses 'q', the game will quit.
-                    q = screen.getch()
-                    if q == ord('q'):
-                        gameon = False
-                        break
-
-                    # Clears the window of the instructions and displays the updated board again. 
-                    screen.clear()
-                    screen.addstr(Board(discard_pile,computer,player,CONTROLS).board)
-                    screen.refresh()
-
-                # If the player presses 'd', a card from the 'player' deck will be added to the discard pile. 
-                # The board displayed will be updated to show the newly added card.
-                elif c == ord('d'):
-                    # Adds a card from the 'player' deck to discard pile.
-                    discard_pile.add_card(player.draw_card())
-
-                    # Clears the window and displays the updated board with the newly added card.
-                    screen.clear()
-                    top_card = Deck.find_card(discard_pile,-1)
-                    screen.addstr(Board(discard_pile,computer,player,CONTROLS).board)
-                    screen.refresh()
-                    
-                    # Checks if a Double event occurs.
-                    if len(discard_pile.deck)>1:
-                        if top_card.rank == discard_pile.deck[-2].rank:
-                            # Times how long it takes for the player to press a key
-                            start = time.time() 
-                            did_slap = screen.getch()
-                            end = time.time()
-                            # Checks if the player pressed 's' and if the player was quick enough
-                            if (did_slap == ord('s')) and ((end-start)<WAIT_TIME): 
-                                # Adds cards to the player's deck and empties the discard pile
-                                for item in discard_pile.deck:
-                                    player.deck.append(item)
-                                    player.shuffle_deck()
-                                    discard_pile = Deck('empty')
-                                    screen.clear()
-                                    screen.addstr(Board(discard_pile,computer,player, CONTROLS).board)
-                                    # Displays who won the event and which event it was
-                                    screen.addstr("\n\nYou slapped first on the Double.")
-                                    screen.refresh()
-                            else:
-                                # Adds cards to the computer's deck and empties the discard pile
-                                for item in discard_pile.deck:
-                                    computer.deck.append(item)
-                                    computer.shuffle_deck()
-                                    discard_pile = Deck('empty')
-                                    screen.clear()
-                                    screen.addstr(Board(discard_pile,computer,player, CONTROLS).board)
-                                    # Displays who won the event and which event it was
-                                    screen.addstr("\n\nComputer slapped first on the Double.")
-                                    screen.refresh()
-                    
-                    # Checks if a Sandwhich event occurs.
-                    if len(discard_pile.deck)>2:
-                        if top_card.rank == Deck.find_card(discard_pile,-3).rank:
-                             # Times how long it takes for the player to press a key
-                            start = time.time()
-                            did_slap = screen.getch()
-                            end = time.time()
-                            # Checks if the player pressed 's' and if the player was quick enough
-                            if (did_slap == ord('s')) and  ((end-start)<WAIT_TIME):
-                                # Adds cards to the player's deck and empties the discard pile
-                                for item in discard_pile.deck:
-                                    player.deck.append(item)
-                                    player.shuffle_deck()
-                                    discard_pile = Deck('empty')
-                                    screen.clear()
-                                    screen.addstr(Board(discard_pile,computer,player,CONTROLS).board)
-                                     # Displays who won the event and which event it was
-                                    screen.addstr('\n\nYou slapped first on the Sandwhich')
-                                    screen.refresh()
-                            else:
-                                # Adds cards to the computer's deck and empties the discard pile
-                                for item in discard_pile.deck:
-                                    computer.deck.append(item)
-                                    computer.shuffle_deck()
-                                    discard_pile = Deck('empty')
-                                    screen.clear()
-                                    screen.addstr(Board(discard_pile,computer,player,CONTROLS).board)
-                                     # Displays who won the event and which event it was
-                                    screen.addstr('\n\nComputer slapped first on the Sandwhich.')
-                                    screen.refresh()
-                                    curses.napms(100) # Pauses to make sure player sees the message. Not neccesary everywhere.
-
-                    curses.napms(600) # Pauses to make sure player sees the message. Done by trial and error.
-
-                    # Flags that the player's turn is done.
-                    player_turn = False
-
-                # If playe presses 'q', the game will quit by changing the flags.
-                elif c == ord('q'):
-                    player_turn = False
-                    gameon = False
-
-                # If the player presses 's' and it is not a slap event, they lose three cards or lose.
-                elif c == ord('s'):
-
-                    #Checks if the player has enough cards in their deck to continue.
-                    if len(player.deck)>=3:
-                        screen.clear()
-                        # Removes three cards from the player's deck and adds them to the discard pile.
-                        Deck.lose_cards(player,discard_pile)
-                        screen.addstr(Board(discard_pile,computer,player, CONTROLS).board)
-                        # Adds a game message underneath the board.
-                        screen.addstr('\n\nOh no. You slapped at the wrong time. 3 of your cards have been added to the bottom of the discard pile')
-                        screen.refresh()
-                    else:
-                        # If the player has less than three cards left, then they automatically lose the game.
-                        screen.clear()
-                        # Gives player a game message and waits for them to press any key.
-                        screen.addstr("\n\nOh no. You slapped at the wrong time. You don't have enough cards to add to the discard pile.")
-                        screen.addstr('\n\nPress any key to continue')
-                        screen.refresh()
-                        screen.getch()
-                        # Empties player's deck so that when control loops to the top, the player will lose.
-                        player = Deck('empty')
-
-                # Warning/error messages for player. The messages don't go away until 'd' or 's' is pressed.
-                # If player presses capitol 'D', the game tells the player the caps lock is on.         
-                elif c == ord('D'):
-                    screen.addstr('\n\nCaps lock is on.')
-
-                # If the player presses any key other that 'd','s','q','i', or 'D', the game tells the player that they pressed the worong key.
+                # If the player presses 'q', the game will quit.
+                q, stamp = await self.next_key()
+                if q == ord('q'):
+                    return False
+
+                # Clears the window of the instructions and displays the updated board again. 
+                self.screen.clear()
+                self.renderer.invalidate()
+                self.show()
+
+            # If the player presses 'd', a card from the 'player' deck will be added to the discard pile. 
+            elif c == ord('d'):
+                # Turn latency is measured from when the key was read.
+                self.turn_started = stamp
+                engine.draw('player')
+                return await self.after_draw()
+
+            # If playe presses 'q', the game will quit.
+            elif c == ord('q'):
+                return False
+
+            # If the player presses 's' and it is not a slap event, they lose three cards or lose.
+            elif c == ord('s'):
+                # A slap that came too late for the last slap event is not a wrong slap, like in the original
+                # game, where the slap event read that key itself.
+                if stamp<=self.late_until:
+                    continue
+                if engine.wrong_slap('player'):
+                    self.show('Oh no. You slapped at the wrong time. 3 of your cards have been added to the bottom of the discard pile')
+                    # A player left with no cards has lost.
+                    if len(self.player.deck)<1:
+                        engine.winner = 'computer'
+                        return True
                 else:
-                    screen.addstr('\n\nWrong key :)')
+                    # Gives player a game message and waits for them to press any key.
+                    self.renderer.show_message("Oh no. You slapped at the wrong time. You don't have enough cards to add to the discard pile.\n\nPress any key to continue")
+                    await self.next_key()
+                    return True
 
-            #Checks if game has ended after the player's turn.    
-            if gameon==False:
-                break
+            # Warning/error messages for player. The messages don't go away until the board is drawn again.
+            # If player presses capitol 'D', the game tells the player the caps lock is on.         
+            elif c == ord('D'):
+                self.renderer.show_message('Caps lock is on.')
+
+            # If the player presses any key other that 'd','s','q','i', or 'D', the game tells the player that they pressed the worong key.
+            else:
+                self.renderer.show_message('Wrong key :)')
+
+    async def computer_turn(self):
+        '''Adds a card from the computer's deck to the discard pile. Returns False if the player quits.'''
+        self.engine.draw('computer')
+        return await self.after_draw()
 
-            # This loop runs for computer's turn i.e. if player_turn == False.
-            while not player_turn:
+    async def after_draw(self):
+        '''Shows the card that was just drawn and runs the slap event it causes, if any. Returns False if the player quits.'''
+        landed = time.perf_counter_ns()
+        self.engine.turns += 1
+        self.show()
 
-                # Checks if the computer has no more cards and therefore the player has won.
-                if len(computer.deck)<1:
-                    gameon = False # Changes game status flag.
-                    event = 'Congrats player, you won' # Changes final messge to user.
+        event = self.engine.slap_event()
+        if event is None:
+            return True
+
+        winner, reaction = await self.slap_race(event, landed)
+        if winner == 'quit':
+            return False
+        if winner is None:
+            self.show('Nobody slapped the {} in time.'.format(event))
+            return True
+
+        # Adds the pile to the winner's deck, empties the discard pile, and displays who won the event and which event it was.
+        self.engine.award_pile(winner, reaction)
+        if winner == 'player':
+            self.show('You slapped first on the {}.'.format(event))
+        else:
+            self.show('Computer slapped first on the {}.'.format(event))
+            if event == 'Sandwhich':
+                await self.pause(self.SANDWHICH_PAUSE)
+        return True
+
+    async def pause(self, seconds):
+        '''Leaves the board up for a moment so the player sees it. With metrics on, also records how much longer
+            than asked the pause took.'''
+        import asyncio
+        start = time.perf_counter_ns()
+        await asyncio.sleep(seconds)
+        metrics = slap_metrics.active
+        if metrics is not None:
+            metrics.observe('pause.oversleep', time.perf_counter_ns() - start - int(seconds * 1e9))
+
+    async def slap_race(self, event, landed):
+        '''Races the player's s key against the computer's slap timer, starting from landed (the perf_counter_ns
+            time the card was shown). Returns the winner and their reaction time in seconds: the winner is
+            'player', 'computer', None if nobody slapped within the wait time, or 'quit' if the player quit. Keys
+            that are not part of the race, like a d typed ahead, stay queued for player_turn.'''
+        engine = self.engine
+        window_end = landed + int(engine.wait_time * 1e9)
+        self.late_until = window_end
+
+        # Works out when the computer will slap. If it is not within the wait time, it does not slap at all.
+        computer_time = engine.policies['computer'].slap_time(engine, event)
+        if computer_time is not None and computer_time<=engine.wait_time:
+            deadline = landed + int(computer_time * 1e9)
+        else:
+            computer_time = None
+            deadline = window_end
+
+        # Keys that are not part of the race are handed back to player_turn afterwards, in the order they came.
+        kept = []
+        try:
+            while True:
+                c, stamp = await self.next_key(deadline)
+                if c is None:
                     break
+                if c == ord('q'):
+                    return 'quit', None
+                # Stops at the first key read after the deadline; the race was already over when it was pressed.
+                if stamp>=deadline:
+                    kept.append((c, stamp))
+                    break
+                # The player wins if they slapped after the card was shown and strictly before the computer did.
+                if c == ord('s') and stamp>=landed:
+                    metrics = slap_metrics.active
+                    if metrics is not None:
+                        metrics.observe('slap.reaction', stamp - landed)
+                        metrics.count('slap.player')
+                    return 'player', (stamp - landed) / 1e9
+                kept.append((c, stamp))
+        finally:
+            self.put_back(kept)
 
-                # Adds a card from the 'computer' deck to the discard pile.
-                discard_pile.add_card(computer.draw_card())
-
-                # Clears the window and adds the updated board with newly added card.
-                screen.clear()
-                top_card = Deck.find_card(discard_pile,-1)
-                screen.addstr(Board(discard_pile,computer,player, CONTROLS).board)  
-                screen.refresh()
-
-                # Checks for a Double event occurs
-                if len(discard_pile.deck)>1:
-                    if top_card.rank == discard_pile.deck[-2].rank:
-                        # 
-                        start = time.time()
-                        did_slap = screen.getch()
-                        end = time.time()
-                        if (did_slap == ord('s')) and ((end-start)<1):
-                            for item in discard_pile.deck:
-                                player.deck.append(item)
-                                player.shuffle_deck()
-                                discard_pile = Deck('empty')
-                                screen.clear()
-                                screen.addstr(Board(discard_pile,computer,player,CONTROLS).board)
-                                screen.addstr('\n\nYou slapped first on the Double')
-                                screen.refresh()
-
-                        else:
-                            for item in discard_pile.deck:
-                                computer.deck.append(item)
-                                computer.shuffle_deck()
-                                discard_pile = Deck('empty')
-                                screen.clear()
-                                screen.addstr(Board(discard_pile,computer,player,CONTROLS).board)
-                                screen.addstr('\n\nComputer slapped first on the Double.')
-                                screen.refresh()
-
-                if len(discard_pile.deck)>2:
-                    if top_card.rank == Deck.find_card(discard_pile,-3).rank:
-                        start = time.time()
-                        did_slap = screen.getch()
-                        end = time.time()
-                        if (did_slap == ord('s')) and  ((end-start)<1):
-                            for item in discard_pile.deck:
-                                player.deck.append(item)
-                                player.shuffle_deck()
-                                discard_pile = Deck('empty')
-                                screen.clear()
-                                screen.addstr(Board(discard_pile,computer,player,CONTROLS).board)
-                                screen.addstr('\n\nYou slapped first on the Sandwhich')
-                                screen.refresh()
-                        else:
-                            for item in discard_pile.deck:
-                                computer.deck.append(item)
-                                computer.shuffle_deck()
-                                discard_pile = Deck('empty')
-                                screen.clear()
-                                screen.addstr(Board(discard_pile,computer,player,CONTROLS).board)
-                                screen.addstr('\n\nComputer slapped first on the Sandwhich.')
-                                screen.refresh()
-
-                curses.napms(500) 
-                
-                #Flags that the computer's turn is done.
-                player_turn = True
-
-        # Closes the window/game.
-        curses.endwin()
-        print(event)
-       
-game = Slap()
-game.game_start()
\ No newline at end of file
+        metrics = slap_metrics.active
+        if metrics is not None:
+            metrics.count('slap.missed' if computer_time is None else 'slap.computer')
+        if computer_time is None:
+            return None, None
+        return 'computer', computer_time
+
+
+def main(argv=None):
+    '''Starts an interactive game from the command line: python W200proj1.py [options].'''
+    import argparse
+    parser = argparse.ArgumentParser(description='Play Slap against the computer in the terminal.')
+    parser.add_argument('--rules', choices=('default', 'house'), default='default',
+                        help="'house' adds Top and Bottom, Marriage, Tens and Run to the Double and Sandwhich")
+    parser.add_argument('--seed', type=int, help='deal and shuffle from this seed')
+    parser.add_argument('--odds', action='store_true', help='show the chance that the next card is a slap event')
+    parser.add_argument('--max-turns', type=int, help='end the game in a draw after this many cards')
+    parser.add_argument('--record', metavar='PATH', help='append a recording of the game to this file')
+    parser.add_argument('--metrics', metavar='PATH', help='write timings to this file (JSON, or CSV for .csv)')
+    args = parser.parse_args(argv)
+    if args.seed is not None and not 0 <= args.seed <= SlapEngine.MAX_SEED:
+        parser.error('--seed must be from 0 to {}'.format(SlapEngine.MAX_SEED))
+
+    rules = HOUSE_RULES if args.rules == 'house' else DEFAULT_RULES
+    game = Slap(record_path=args.record, metrics_path=args.metrics, rules=rules, show_odds=args.odds,
+                max_turns=args.max_turns, seed=args.seed)
+    game.game_start()
+
+
+if __name__ == '__main__':
+    main()
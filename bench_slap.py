@@ -0,0 +1,284 @@
+'''Benchmarks for the hot paths of Slap, with a stored baseline to catch slowdowns.
+
+Every benchmark uses fixed seeds, so each run times exactly the same work: building decks, drawing and adding
+cards, losing cards to a wrong slap, picking up the pile, building the Board string, drawing the board with the
+Renderer, checking the pile for slap events, and whole headless games. Rendering is timed against FakeScreen, so
+no terminal is needed.
+
+Each benchmark is called once to warm up (building the SlapMatcher table, for example), then run number times
+in a row, repeat times over, and the fastest round gives its time per operation. The results are compared with a
+baseline file (bench_baseline.json by default): a benchmark fails if it is more than threshold times slower than
+its baseline, and any failure makes the run exit with status 1. The baseline belongs to the machine it was made
+on, so it is not checked in; a run with no baseline fails too, until --update-baseline saves this run as one.
+
+    python bench_slap.py                                  compare with the baseline
+    python bench_slap.py --threshold 1.5                  allow up to 50% slower
+    python bench_slap.py --threshold-for games=2.0        a looser limit for one benchmark
+    python bench_slap.py --update-baseline                save this run as the baseline (needed the first time)'''
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import timeit
+
+from W200proj1 import CONTROLS, DEFAULT_RULES, HOUSE_RULES, Board, Deck, Renderer, SlapMatcher, simulate
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+THRESHOLD = 1.25
+SEED = 1234
+
+# name -> (function that sets up a benchmark and returns the callable to time, operations per call, number)
+BENCHMARKS = {}
+
+
+def benchmark(name, number, ops=1):
+    '''Registers a setup function as a benchmark. The callable it returns is timed number times per round and
+        does ops operations each time.'''
+    def register(setup):
+        BENCHMARKS[name] = (setup, ops, number)
+        return setup
+    return register
+
+
+class FakeScreen:
+    '''Stands in for a curses window. It keeps the text written to each row, so a benchmark renders the same
+        work a terminal would be sent without needing one.'''
+
+    def __init__(self):
+        self.rows = {}
+        self.row = 0
+        self.written = 0
+
+    def move(self, row, column):
+        self.row = row
+
+    def clrtoeol(self):
+        self.rows.pop(self.row, None)
+
+    def clrtobot(self):
+        for row in [row for row in self.rows if row>=self.row]:
+            del self.rows[row]
+
+    def addstr(self, row, column, text):
+        self.rows[row] = text
+        self.written += len(text)
+
+    def noutrefresh(self):
+        pass
+
+
+def seeded_deck(seed=SEED):
+    '''Returns a full deck shuffled from seed.'''
+    return Deck(rng=random.Random(seed))
+
+
+@benchmark('deck_full', 2000)
+def bench_deck_full():
+    rng = random.Random(SEED)
+    return lambda: Deck(rng=rng)
+
+
+@benchmark('deck_empty', 20000)
+def bench_deck_empty():
+    return lambda: Deck('empty')
+
+
+@benchmark('draw_add', 100000)
+def bench_draw_add():
+    deck = seeded_deck()
+    return lambda: deck.add_card(deck.draw_card())
+
+
+@benchmark('lose_cards', 50000)
+def bench_lose_cards():
+    player = seeded_deck()
+    pile = Deck('empty')
+
+    def run():
+        Deck.lose_cards(player, pile)
+        # Puts the three cards back so every call does the same work.
+        player.extend_bottom(pile.burn(3))
+    return run
+
+
+@benchmark('pile_pickup', 10000)
+def bench_pile_pickup():
+    deck = seeded_deck()
+    pile = Deck('empty')
+    pile.extend_bottom(deck.burn(26))
+    rng = random.Random(SEED)
+
+    def run():
+        deck.absorb(pile, rng)
+        # Deals a 26 card pile back out so every call picks up the same number of cards.
+        pile.extend_bottom(deck.burn(26))
+    return run
+
+
+@benchmark('board', 20000)
+def bench_board():
+    deck = seeded_deck()
+    pile = Deck('empty')
+    pile.extend_bottom(deck.burn(10))
+    comp = Deck('empty')
+    comp.extend_bottom(deck.burn(21))
+    return lambda: Board(pile, comp, deck, CONTROLS)
+
+
+@benchmark('render', 20000)
+def bench_render():
+    '''Draws the board after every card, so the top card and one count change each time.'''
+    renderer = Renderer(FakeScreen(), update=lambda: None)
+    deck = seeded_deck()
+    comp = Deck('empty')
+    comp.extend_bottom(deck.burn(26))
+    pile = Deck('empty')
+
+    def run():
+        pile.add_card(deck.draw_card())
+        renderer.draw(pile, comp, deck)
+        deck.add_card(pile.burn(1)[0])
+    return run
+
+
+@benchmark('render_unchanged', 50000)
+def bench_render_unchanged():
+    renderer = Renderer(FakeScreen(), update=lambda: None)
+    deck = seeded_deck()
+    pile = Deck('empty')
+    pile.extend_bottom(deck.burn(10))
+    return lambda: renderer.draw(pile, deck, deck)
+
+
+@benchmark('slap_match', 100000)
+def bench_slap_match():
+    matcher = SlapMatcher.get(HOUSE_RULES)
+    pile = seeded_deck().deck
+    return lambda: matcher.match(pile)
+
+
+@benchmark('games', 3, ops=20)
+def bench_games():
+    '''Whole headless games with the default policies; the time per operation is per game.'''
+    return lambda: simulate(20, seed=SEED, rules=DEFAULT_RULES)
+
+
+def run_benchmarks(names=None, repeat=5):
+    '''Runs the benchmarks (all of them, or the ones named) and returns name -> nanoseconds per operation.'''
+    results = {}
+    for name, (setup, ops, number) in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        # Every benchmark starts from the same global random state too.
+        random.seed(SEED)
+        run = setup()
+        # The first call pays for one-off work like building tables, which is not what is being timed.
+        run()
+        best = min(timeit.Timer(run).repeat(repeat, number))
+        results[name] = best / (number * ops) * 1e9
+    return results
+
+
+def load_baseline(path):
+    '''Returns the saved name -> nanoseconds per operation, or None if there is no baseline file.'''
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return {name: entry['ns_per_op'] for name, entry in json.load(file)['benchmarks'].items()}
+
+
+def save_baseline(path, results):
+    data = {'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+            'machine': platform.machine(),
+            'benchmarks': {name: {'ns_per_op': ns} for name, ns in sorted(results.items())}}
+    with open(path, 'w') as file:
+        json.dump(data, file, indent=2, sort_keys=True)
+        file.write('\n')
+
+
+def compare(results, baseline, threshold=THRESHOLD, thresholds=None):
+    '''Compares results with baseline. Returns a list of (name, ns per op, baseline ns per op or None, ratio or
+        None, failed), where failed means the benchmark is more than its threshold times slower.'''
+    thresholds = thresholds or {}
+    rows = []
+    for name, ns in results.items():
+        base = baseline.get(name)
+        if base is None:
+            rows.append((name, ns, None, None, False))
+            continue
+        ratio = ns / base
+        rows.append((name, ns, base, ratio, ratio>thresholds.get(name, threshold)))
+    return rows
+
+
+def report(rows):
+    print('{:<18} {:>14} {:>14} {:>8}'.format('benchmark', 'ns/op', 'baseline', 'ratio'))
+    for name, ns, base, ratio, failed in rows:
+        if base is None:
+            print('{:<18} {:>14.1f} {:>14} {:>8}'.format(name, ns, '-', 'new'))
+        else:
+            print('{:<18} {:>14.1f} {:>14.1f} {:>7.2f}x{}'.format(name, ns, base, ratio, '  SLOWER' if failed else ''))
+    games = [ns for name, ns, base, ratio, failed in rows if name == 'games']
+    if games:
+        print('headless games per second: {:.0f}'.format(1e9 / games[0]))
+
+
+def parse_thresholds(items):
+    '''Turns NAME=RATIO strings into a dict.'''
+    thresholds = {}
+    for item in items:
+        name, _, ratio = item.partition('=')
+        if name not in BENCHMARKS or not ratio:
+            raise SystemExit('Invalid --threshold-for {!r}: expected one of {} followed by =RATIO'.format(
+                item, ', '.join(BENCHMARKS)))
+        thresholds[name] = float(ratio)
+    return thresholds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths of Slap against a saved baseline.')
+    parser.add_argument('names', nargs='*', help='benchmarks to run (default: all of {})'.format(', '.join(BENCHMARKS)))
+    parser.add_argument('--baseline', default=BASELINE, help='baseline file (default: %(default)s)')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='fail if a benchmark is more than this many times slower (default: %(default)s)')
+    parser.add_argument('--threshold-for', action='append', default=[], metavar='NAME=RATIO',
+                        help='a different threshold for one benchmark')
+    parser.add_argument('--repeat', type=int, default=5, help='rounds per benchmark; the fastest counts')
+    parser.add_argument('--update-baseline', action='store_true', help='save this run as the baseline')
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error('unknown benchmark(s): ' + ', '.join(unknown))
+    thresholds = parse_thresholds(args.threshold_for)
+
+    results = run_benchmarks(args.names, args.repeat)
+    baseline = load_baseline(args.baseline)
+    if baseline is None and not args.update_baseline:
+        report(compare(results, {}))
+        print('No baseline at {}; run with --update-baseline to save this machine\'s baseline.'.format(args.baseline))
+        return 1
+    if args.update_baseline:
+        if baseline is not None:
+            # Keeps the baseline of any benchmark that was not run this time.
+            results = dict(baseline, **results)
+        report(compare(results, {}))
+        save_baseline(args.baseline, results)
+        print('Saved baseline to', args.baseline)
+        return 0
+
+    rows = compare(results, baseline, args.threshold, thresholds)
+    report(rows)
+    failed = [row[0] for row in rows if row[4]]
+    if failed:
+        print('Slower than the baseline allows:', ', '.join(failed))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
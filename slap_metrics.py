@@ -0,0 +1,162 @@
+'''Counters and timing histograms for the hot paths of Slap.
+
+Nothing is measured until enable() is called. Classes register the methods they want timed with register(); enable()
+swaps those methods for timed wrappers and disable() puts the originals back, so when metrics are off the game runs
+exactly the code it would without this module. The few hand-placed hooks (slap reaction times, turn latency) check
+the module-level active attribute, which is None while metrics are off.
+
+While enabled, active.snapshot() can be polled at any time, and to_json()/write_csv() dump everything at the end.
+All times are in nanoseconds.'''
+
+import functools
+import time
+
+# csv and json are imported when the metrics are written, so importing this module (which the game always does)
+# stays cheap.
+
+# The Metrics object that is collecting, or None while metrics are off.
+active = None
+
+# (class, method names, metric prefix) for every class that asked to be timed.
+_registered = []
+# (class, method name, original function) for every method that is currently wrapped.
+_wrapped = []
+
+
+class Histogram:
+    '''Counts values into power-of-two buckets: bucket i holds values with i binary digits, so bucket 20 holds
+        0.5ms to 1ms when values are nanoseconds. Also keeps the exact count, total, minimum and maximum.'''
+
+    def __init__(self):
+        self.buckets = [0] * 65
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        value = int(value)
+        self.buckets[min(max(value, 0).bit_length(), 64)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value<self.min:
+            self.min = value
+        if self.max is None or value>self.max:
+            self.max = value
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, fraction):
+        '''Returns an upper bound for the given percentile (0.5 for the median), from the bucket it falls in.'''
+        if not self.count:
+            return 0
+        target = fraction * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen>=target:
+                return min((1 << i) - 1, self.max)
+        return self.max
+
+    def summary(self):
+        return {'count': self.count, 'total': self.total, 'mean': self.mean(), 'min': self.min, 'max': self.max,
+                'p50': self.percentile(0.5), 'p90': self.percentile(0.9), 'p99': self.percentile(0.99)}
+
+
+class Metrics:
+    '''A set of named counters and histograms.'''
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.started = time.time()
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, value):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(value)
+
+    def snapshot(self):
+        '''Returns the current counters and histogram summaries as a dict.'''
+        return {'started': self.started,
+                'counters': dict(self.counters),
+                'histograms': {name: h.summary() for name, h in self.histograms.items()}}
+
+    def to_json(self):
+        import json
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+    def write_csv(self, file):
+        '''Writes one row per counter and per histogram to an open text file.'''
+        import csv
+        fields = ['name', 'kind', 'count', 'total', 'mean', 'min', 'max', 'p50', 'p90', 'p99']
+        writer = csv.DictWriter(file, fields)
+        writer.writeheader()
+        for name, value in sorted(self.counters.items()):
+            writer.writerow({'name': name, 'kind': 'counter', 'count': value})
+        for name, histogram in sorted(self.histograms.items()):
+            writer.writerow(dict(histogram.summary(), name=name, kind='histogram'))
+
+    def dump(self, path):
+        '''Writes the metrics to path, as CSV if it ends in .csv and as JSON otherwise.'''
+        with open(path, 'w', newline='') as file:
+            if path.endswith('.csv'):
+                self.write_csv(file)
+            else:
+                file.write(self.to_json())
+
+
+def register(cls, names, prefix):
+    '''Asks for methods of cls to be timed as '<prefix>.<name>' whenever metrics are enabled.'''
+    _registered.append((cls, tuple(names), prefix))
+    if active is not None:
+        _wrap(cls, names, prefix)
+
+
+def _timed(name, func):
+    perf_counter_ns = time.perf_counter_ns
+
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        start = perf_counter_ns()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            metrics = active
+            if metrics is not None:
+                metrics.observe(name, perf_counter_ns() - start)
+    return timed
+
+
+def _wrap(cls, names, prefix):
+    for name in names:
+        original = cls.__dict__[name]
+        setattr(cls, name, _timed(prefix + '.' + name, original))
+        _wrapped.append((cls, name, original))
+
+
+def enable(metrics=None):
+    '''Starts collecting into metrics (a new Metrics if not given) and returns it.'''
+    global active
+    if active is not None:
+        disable()
+    active = metrics if metrics is not None else Metrics()
+    for cls, names, prefix in _registered:
+        _wrap(cls, names, prefix)
+    return active
+
+
+def disable():
+    '''Stops collecting, puts every timed method back, and returns the Metrics that was collecting.'''
+    global active
+    while _wrapped:
+        cls, name, original = _wrapped.pop()
+        setattr(cls, name, original)
+    metrics = active
+    active = None
+    return metrics
@@ -0,0 +1,204 @@
+'''Recording and replaying games of Slap.
+
+A recorded game is its seed plus a stream of small fixed-size events: every card drawn, every slap that won a
+pile (with the slapper's reaction time), every wrong slap and every pile award. SlapEngine deals and shuffles
+only from the seed, so replaying the events through a fresh SlapEngine rebuilds the exact game, card for card,
+without curses, policies or pauses.
+
+Recordings are appended to a corpus file one after another. Each one is a header followed by its events:
+
+    header  '<4sQfIbB2x' magic b'SLPG', seed, wait time, number of events, winner (0 player, 1 computer, -1 none),
+                         slap rules (an index into RULE_SETS, or CUSTOM_RULES)
+    event   '<BBHI'      kind (EVENT_DRAW/SLAP/PENALTY/AWARD), side (0 player, 1 computer), value, time in ms
+
+The value is the card's rank code for a draw, the reaction time in ms for a slap, the number of cards burned
+for a wrong slap, and the size of the pile for an award. RecordingReader memory-maps a corpus and hands out
+views into it, so a scan over millions of games never copies the events or turns them into Python objects
+unless asked to (numpy.frombuffer(recording.events, EVENT_DTYPE) also works on the views).
+
+The slap rules byte sits in what used to be padding, so older recordings read back as played with DEFAULT_RULES,
+which is what they were played with.'''
+
+import mmap
+import struct
+import time
+
+from W200proj1 import (DEFAULT_RULES, EVENT_AWARD, EVENT_DRAW, EVENT_PENALTY, EVENT_SLAP, HOUSE_RULES, WAIT_TIME,
+                       SlapEngine, simulate)
+
+MAGIC = b'SLPG'
+HEADER = struct.Struct('<4sQfIbB2x')
+EVENT = struct.Struct('<BBHI')
+
+# Field layout of one event, for numpy.frombuffer.
+EVENT_DTYPE = [('kind', 'u1'), ('side', 'u1'), ('value', '<u2'), ('time', '<u4')]
+
+SIDES = SlapEngine.SIDES
+SIDE_CODES = {side: code for code, side in enumerate(SIDES)}
+
+# The slap rules a recording can name, by their index. Games played with any other rules are stored as
+# CUSTOM_RULES and have to be replayed with their rules given.
+RULE_SETS = (DEFAULT_RULES, HOUSE_RULES)
+CUSTOM_RULES = 255
+
+
+def rules_code(rules):
+    '''Returns the code a recording stores for rules.'''
+    rules = tuple(rules)
+    return RULE_SETS.index(rules) if rules in RULE_SETS else CUSTOM_RULES
+
+
+class ReplayError(Exception):
+    '''Raised when a recording does not match what the rules produce from its seed.'''
+
+
+class GameRecorder:
+    '''Collects the events of one game as packed bytes. Pass it to SlapEngine as recorder. Times are in
+        milliseconds since the recorder was made, measured with clock (a function returning nanoseconds).'''
+
+    def __init__(self, clock=time.perf_counter_ns):
+        self.clock = clock
+        self.start = clock()
+        self.events = bytearray()
+
+    def record(self, kind, side, value=0):
+        elapsed = (self.clock() - self.start) // 1000000
+        self.events += EVENT.pack(kind, SIDE_CODES[side], value, elapsed)
+
+    def to_bytes(self, engine):
+        '''Returns the header and events of the finished game played by engine.'''
+        winner = -1 if engine.winner is None else SIDE_CODES[engine.winner]
+        header = HEADER.pack(MAGIC, engine.seed, engine.wait_time, len(self.events) // EVENT.size, winner,
+                             rules_code(engine.matcher.rules))
+        return header + bytes(self.events)
+
+
+class Recording:
+    '''One recorded game read back from a buffer. events is a memoryview of the packed events; iterating over
+        the Recording unpacks them as (kind, side, value, time) tuples. rules are the slap rules the game was
+        played with, or None if they were custom ones.'''
+
+    def __init__(self, buffer, offset=0):
+        magic, seed, wait_time, n_events, winner, rules = HEADER.unpack_from(buffer, offset)
+        if magic != MAGIC:
+            raise ReplayError('Not a Slap recording at offset {}.'.format(offset))
+        self.seed = seed
+        self.wait_time = wait_time
+        self.n_events = n_events
+        self.winner = None if winner < 0 else SIDES[winner]
+        self.rules = RULE_SETS[rules] if rules < len(RULE_SETS) else None
+        start = offset + HEADER.size
+        self.end = start + n_events * EVENT.size
+        self.events = memoryview(buffer)[start:self.end]
+
+    def __iter__(self):
+        return EVENT.iter_unpack(self.events)
+
+    def __len__(self):
+        return self.n_events
+
+    def __repr__(self):
+        return 'Recording(seed={self.seed}, events={self.n_events}, winner={self.winner!r})'.format(self=self)
+
+
+def replay(recording, rules=None):
+    '''Plays a recording through SlapEngine as fast as possible and returns the engine at the end of the game.
+        Raises ReplayError if a drawn card, a pile award or the winner does not match the recording. The game is
+        replayed with the slap rules the recording names, unless rules are given; a game played with custom
+        rules can only be replayed by giving them.'''
+    if rules is None:
+        rules = recording.rules
+        if rules is None:
+            raise ReplayError('Recording was played with custom slap rules; pass them to replay.')
+    engine = SlapEngine(wait_time=recording.wait_time, seed=recording.seed, rules=rules)
+    for kind, side_code, value, elapsed in recording:
+        side = SIDES[side_code]
+        if kind == EVENT_DRAW:
+            card = engine.draw(side)
+            if card is None or card.code != value:
+                raise ReplayError('Recorded draw of rank code {} but the deck gave {}.'.format(value, card))
+            engine.turns += 1
+        elif kind == EVENT_AWARD:
+            if engine.slap_event() is None:
+                raise ReplayError('Recorded award of a pile that shows no slap event.')
+            engine.award_pile(side)
+        elif kind == EVENT_PENALTY:
+            engine.wrong_slap(side)
+        elif kind != EVENT_SLAP:
+            raise ReplayError('Unknown event kind {}.'.format(kind))
+
+    # Finishes the game the same way SlapEngine.step does: whoever has run out of cards has lost.
+    if engine.winner is None and recording.winner is not None:
+        loser = SlapEngine.SIDES[1 - SIDE_CODES[recording.winner]]
+        if len(engine.deck_of(loser).deck)<1:
+            engine.winner = recording.winner
+    if engine.winner != recording.winner:
+        raise ReplayError('Recording says {} won but the replay gives {}.'.format(recording.winner, engine.winner))
+    return engine
+
+
+class RecordingWriter:
+    '''Appends recordings to a corpus file. Existing recordings are never rewritten.'''
+
+    def __init__(self, path):
+        self.file = open(path, 'ab')
+
+    def new_recorder(self):
+        return GameRecorder()
+
+    def write(self, recorder, engine):
+        '''Appends the game engine just played, recorded by recorder.'''
+        self.file.write(recorder.to_bytes(engine))
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RecordingReader:
+    '''Reads a corpus file through a memory map. Iterating yields a Recording for every game in the file; their
+        events are views into the map, so the reader has to stay open while they are used.'''
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # An empty file cannot be mapped.
+            self.map = b''
+
+    def __iter__(self):
+        offset = 0
+        size = len(self.map)
+        while offset<size:
+            recording = Recording(self.map, offset)
+            yield recording
+            offset = recording.end
+
+    def close(self):
+        if isinstance(self.map, mmap.mmap):
+            try:
+                self.map.close()
+            except BufferError:
+                # Some Recording views are still in use; the map is freed along with them.
+                pass
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def record_games(path, n_games, seed=None, player_policy=None, computer_policy=None, wait_time=WAIT_TIME,
+                 max_turns=10000, rules=DEFAULT_RULES, on_repeat=None):
+    '''Plays n_games headless games and appends their recordings to path. Returns the SimulationResult.'''
+    with RecordingWriter(path) as corpus:
+        return simulate(n_games, seed, player_policy, computer_policy, wait_time, max_turns, corpus, rules,
+                        on_repeat)
@@ -0,0 +1,412 @@
+'''Plays Slap over the network: one asyncio process hosts many tables at once, each a SlapEngine shared by two
+connected clients.
+
+Clients connect over TCP or a Unix socket and talk in lines of ASCII words. A client sends JOIN to sit down, is
+paired with the next client to join, and is told which side of the engine it plays.
+
+    client -> server
+        JOIN                     sit at the next table with a free seat
+        DRAW                     put the top card of your deck on the pile (only on your turn)
+        SLAP                     slap the pile
+        QUIT                     leave the table (the other seat wins)
+
+    server -> client
+        SEAT <side>              you play side ('player' goes first, or 'computer')
+        TURN <side>              it is side's turn to draw
+        CARD <side> <rank> <player cards> <computer cards> <pile size>
+        EVENT <name>             the pile is showing a slap event
+        WON <side> <event> <ms>  side won the pile, slapping ms milliseconds after the card was sent
+        MISSED <event>           nobody slapped the event in time
+        PENALTY <side> <burned>  side slapped at the wrong time and burned cards to the bottom of the pile
+        END <side|draw> <reason> <seed>
+                                 the game is over and was dealt from seed; send JOIN to play again
+        ERROR <message>
+
+The seed is only sent once the game is over: the engine deals and shuffles every pickup from it alone, so a client
+that had it could see every card coming and slap an event the moment it opened.
+
+Slaps are timed by the server, not by the clients: every line is stamped with time.monotonic_ns() as soon as it
+is read, and a slap event goes to the earliest stamp. Once the first slap of an event is in, the table waits
+grace seconds for the other seat's slap before deciding, so a slap that was in flight at the same time still
+gets a fair comparison; with equal stamps the 'computer' seat wins, like in SlapEngine. Nobody slapping within
+wait_time counts as a miss. A slap that comes after the event was decided but within wait_time of the card is
+ignored rather than punished as a wrong slap.
+
+Tables are driven by the lines their clients send and by loop.call_later timers, so a table has no task of its
+own. Its memory is bounded: the engine never holds more than 52 cards, and it only remembers the last
+history_size position hashes for spotting repeats (HISTORY_SIZE by default, about 50 KB a table; the engine's own
+default of 4096 would be about 0.5 MB). Lines longer than LINE_LIMIT are refused, and a client that lets more than
+WRITE_LIMIT bytes of output pile up is disconnected (and forfeits).
+
+load_test() runs a server and simulated bot clients on loopback, and 'python slap_server.py load' runs one from
+the command line.'''
+
+import argparse
+import asyncio
+import random
+import time
+
+from W200proj1 import DEFAULT_RULES, WAIT_TIME, RandomStream, SlapEngine
+
+# The longest line a client may send, and how much output may wait to be sent to one client.
+LINE_LIMIT = 64
+WRITE_LIMIT = 64 * 1024
+# How many recent positions each table remembers for spotting repeats.
+HISTORY_SIZE = 256
+
+
+class Seat:
+    '''One connected client, and the table and side it is playing, if any.'''
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.table = None
+        self.side = None
+
+    def send(self, data):
+        '''Queues bytes for the client. Returns False (and closes the connection) if the client is not reading.'''
+        writer = self.writer
+        if writer.is_closing():
+            return False
+        writer.write(data)
+        if writer.transport.get_write_buffer_size()>WRITE_LIMIT:
+            writer.close()
+            return False
+        return True
+
+
+class Table:
+    '''One game between two seats. Commands from the seats come in through draw() and slap() with the time they
+        were read, and the table tells both seats what happened.'''
+
+    def __init__(self, server, seats, seed):
+        self.server = server
+        self.engine = SlapEngine(wait_time=server.wait_time, seed=seed, rules=server.rules, on_repeat='draw',
+                                 history_size=server.history_size)
+        self.seats = dict(zip(SlapEngine.SIDES, seats))
+        self.loop = asyncio.get_running_loop()
+        self.over = False
+
+        # The slap event being raced for, when the card showing it was sent, the first slap stamp of each side,
+        # and the timer that will decide it.
+        self.event = None
+        self.landed = None
+        self.slaps = {}
+        self.timer = None
+        # Slaps stamped before this time were aimed at a slap event that has already been decided.
+        self.late_until = 0
+        # Lines waiting to be sent to both seats. They go out together once the current command or timer is done,
+        # so a turn costs one write per seat instead of one per line.
+        self.outbox = []
+
+        for side, seat in self.seats.items():
+            seat.table = self
+            seat.side = side
+            seat.send('SEAT {}\n'.format(side).encode())
+        self.broadcast('TURN player')
+
+    def broadcast(self, line):
+        if not self.outbox:
+            self.loop.call_soon(self.flush)
+        self.outbox.append(line)
+
+    def flush(self):
+        data = ('\n'.join(self.outbox) + '\n').encode()
+        self.outbox = []
+        for side, seat in self.seats.items():
+            if not seat.send(data):
+                # The seat stopped reading; it has lost.
+                self.forfeit(side)
+
+    def draw(self, side, stamp):
+        engine = self.engine
+        if self.event is not None:
+            return 'slap event in progress'
+        if side != engine.current_side():
+            return 'not your turn'
+
+        card = engine.draw(side)
+        engine.turns += 1
+        self.broadcast('CARD {} {} {} {} {}'.format(side, card, len(engine.player.deck), len(engine.computer.deck),
+                                                   len(engine.discard_pile.deck)))
+        event = engine.slap_event()
+        if event is None:
+            self.next_turn()
+            return None
+
+        # Opens the slap event from the moment the card was sent.
+        self.event = event
+        self.landed = time.monotonic_ns()
+        self.slaps = {}
+        self.timer = self.loop.call_later(engine.wait_time, self.decide)
+        self.broadcast('EVENT ' + event)
+        return None
+
+    def slap(self, side, stamp):
+        engine = self.engine
+        if self.event is None:
+            if stamp<=self.late_until:
+                return None
+            # Slapping when there is no slap event costs three cards, or the game.
+            burned = engine.wrong_slap(side)
+            self.broadcast('PENALTY {} {}'.format(side, 3 if burned else 0))
+            if not burned or len(engine.deck_of(side).deck)<1:
+                self.end(engine.other(side), 'out-of-cards')
+            return None
+
+        if side in self.slaps:
+            return None
+        self.slaps[side] = stamp
+        if len(self.slaps) == len(self.seats):
+            self.timer.cancel()
+            self.decide()
+        elif len(self.slaps) == 1:
+            # Gives the other seat's slap grace seconds to arrive, without going past the wait time.
+            self.timer.cancel()
+            remaining = engine.wait_time - (time.monotonic_ns() - self.landed) / 1e9
+            self.timer = self.loop.call_later(max(min(self.server.grace, remaining), 0), self.decide)
+        return None
+
+    def decide(self):
+        '''Ends the slap event: the earliest slap within the wait time wins the pile.'''
+        if self.over or self.event is None:
+            return
+        engine = self.engine
+        event = self.event
+        limit = self.landed + int(engine.wait_time * 1e9)
+        slaps = [(stamp, side == 'player', side) for side, stamp in self.slaps.items() if stamp<=limit]
+        self.event = None
+        self.timer = None
+        self.late_until = limit
+        if slaps:
+            stamp, loses_ties, side = min(slaps)
+            reaction = max(stamp - self.landed, 0) / 1e9
+            engine.award_pile(side, reaction)
+            self.broadcast('WON {} {} {}'.format(side, event, int(reaction * 1000)))
+        else:
+            self.broadcast('MISSED ' + event)
+        self.next_turn()
+
+    def next_turn(self):
+        '''Hands the turn to the other side, or ends the game.'''
+        engine = self.engine
+        engine.player_turn = not engine.player_turn
+        if engine.turns>=self.server.max_turns or engine.check_repeat():
+            self.end('draw', 'max-turns' if not engine.drawn else 'repeat')
+            return
+        side = engine.current_side()
+        if len(engine.deck_of(side).deck)<1:
+            self.end(engine.other(side), 'out-of-cards')
+            return
+        self.broadcast('TURN ' + side)
+
+    def forfeit(self, side):
+        if not self.over:
+            self.end(self.engine.other(side), 'forfeit')
+
+    def end(self, winner, reason):
+        if self.over:
+            return
+        self.broadcast('END {} {} {}'.format(winner, reason, self.engine.seed))
+        self.over = True
+        if self.timer is not None:
+            self.timer.cancel()
+        for seat in self.seats.values():
+            seat.table = None
+            seat.side = None
+        self.server.finished(self, winner)
+
+
+class SlapServer:
+    '''Accepts clients, pairs them up at tables and passes their commands on. Every table is dealt from its own
+        seed, drawn from a RandomStream made from seed, so a server given a seed deals the same games in the
+        same order. Games that repeat one of their last history_size positions or go on for max_turns cards end
+        in a draw.'''
+
+    def __init__(self, wait_time=WAIT_TIME, grace=0.05, max_turns=10000, seed=None, rules=DEFAULT_RULES,
+                 history_size=HISTORY_SIZE):
+        self.wait_time = wait_time
+        self.grace = grace
+        self.max_turns = max_turns
+        self.history_size = history_size
+        self.rules = rules
+        self.rng = RandomStream(seed)
+        self.waiting = None
+        self.tables = set()
+        self.games = 0
+        self.results = {'player': 0, 'computer': 0, 'draw': 0}
+
+    async def start(self, host='127.0.0.1', port=0):
+        '''Starts listening on TCP and returns the asyncio Server.'''
+        return await asyncio.start_server(self.handle_client, host, port, limit=LINE_LIMIT)
+
+    async def start_unix(self, path):
+        '''Starts listening on a Unix socket and returns the asyncio Server.'''
+        return await asyncio.start_unix_server(self.handle_client, path, limit=LINE_LIMIT)
+
+    async def handle_client(self, reader, writer):
+        seat = Seat(writer)
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):
+                    # The line was too long or the connection broke.
+                    break
+                stamp = time.monotonic_ns()
+                if not line:
+                    break
+                command = line.strip().upper()
+                if command == b'QUIT':
+                    break
+                error = self.command(seat, command, stamp)
+                if error is not None:
+                    seat.send('ERROR {}\n'.format(error).encode())
+        finally:
+            self.leave(seat)
+            writer.close()
+
+    def command(self, seat, command, stamp):
+        '''Carries out one command from seat. Returns an error message, or None.'''
+        table = seat.table
+        if command == b'JOIN':
+            if table is not None or self.waiting is seat:
+                return 'already joined'
+            if self.waiting is None:
+                self.waiting = seat
+            else:
+                seats = (self.waiting, seat)
+                self.waiting = None
+                self.tables.add(Table(self, seats, self.rng.getrandbits(63)))
+            return None
+        if table is None:
+            return 'not at a table'
+        if command == b'DRAW':
+            return table.draw(seat.side, stamp)
+        if command == b'SLAP':
+            return table.slap(seat.side, stamp)
+        return 'unknown command'
+
+    def leave(self, seat):
+        if self.waiting is seat:
+            self.waiting = None
+        if seat.table is not None:
+            seat.table.forfeit(seat.side)
+
+    def finished(self, table, winner):
+        self.tables.discard(table)
+        self.games += 1
+        self.results[winner] += 1
+
+
+class Bot:
+    '''A simulated client for load tests. It draws think seconds after its turn comes up, slaps a slap event
+        after a random reaction time between low and high seconds (missing it with probability miss_rate), and
+        plays games one after another on the same connection.'''
+
+    def __init__(self, games=1, low=0.1, high=0.4, miss_rate=0.0, think=0.0, rng=None):
+        self.games = games
+        self.low = low
+        self.high = high
+        self.miss_rate = miss_rate
+        self.think = think
+        self.rng = rng or random.Random()
+        self.played = 0
+        self.wins = 0
+        self.lines = 0
+
+    async def play(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        side = None
+        writer.write(b'JOIN\n')
+        while self.played<self.games:
+            line = await reader.readline()
+            if not line:
+                break
+            self.lines += 1
+            words = line.split()
+            kind = words[0]
+            if kind == b'TURN':
+                if words[1].decode() == side:
+                    loop.call_later(self.think, self.send, writer, b'DRAW\n')
+            elif kind == b'EVENT':
+                if self.rng.random() >= self.miss_rate:
+                    loop.call_later(self.rng.uniform(self.low, self.high), self.send, writer, b'SLAP\n')
+            elif kind == b'SEAT':
+                side = words[1].decode()
+            elif kind == b'END':
+                self.played += 1
+                if words[1].decode() == side:
+                    self.wins += 1
+                if self.played<self.games:
+                    writer.write(b'JOIN\n')
+        self.send(writer, b'QUIT\n')
+        writer.close()
+
+    def send(self, writer, data):
+        # Slaps and draws are sent on timers, which can go off after the connection has closed.
+        if not writer.is_closing():
+            writer.write(data)
+
+
+async def load_test(tables=100, games=1, unix_path=None, seed=0, wait_time=WAIT_TIME, grace=0.05, **bot_options):
+    '''Starts a server, connects 2 * tables bots to it over loopback TCP (or unix_path), lets every bot play
+        games games, and returns a dict of totals and games per second. bot_options are passed to Bot.'''
+    server = SlapServer(wait_time=wait_time, grace=grace, seed=seed)
+    if unix_path is None:
+        listener = await server.start()
+        host, port = listener.sockets[0].getsockname()[:2]
+        connect = lambda: asyncio.open_connection(host, port)
+    else:
+        listener = await server.start_unix(unix_path)
+        connect = lambda: asyncio.open_unix_connection(unix_path)
+
+    streams = RandomStream(seed).spawn(2 * tables)
+    bots = [Bot(games, rng=stream, **bot_options) for stream in streams]
+
+    async def run(bot):
+        reader, writer = await connect()
+        await bot.play(reader, writer)
+
+    start = time.perf_counter()
+    async with listener:
+        await asyncio.gather(*(run(bot) for bot in bots))
+    seconds = time.perf_counter() - start
+    return {'tables': tables, 'games': server.games, 'results': server.results, 'seconds': seconds,
+            'games_per_second': server.games / seconds if seconds else 0.0,
+            'lines_per_second': sum(bot.lines for bot in bots) / seconds if seconds else 0.0}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Slap game server.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help='run a server')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    serve.add_argument('--unix', help='listen on this Unix socket instead of TCP')
+    serve.add_argument('--seed', type=int)
+    load = commands.add_parser('load', help='run a load test with bots on loopback')
+    load.add_argument('--tables', type=int, default=1000)
+    load.add_argument('--games', type=int, default=1)
+    load.add_argument('--unix', help='use this Unix socket instead of TCP')
+    load.add_argument('--think', type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    if args.command == 'load':
+        print(asyncio.run(load_test(args.tables, args.games, args.unix, think=args.think)))
+        return
+
+    async def serve_forever():
+        server = SlapServer(seed=args.seed)
+        if args.unix:
+            listener = await server.start_unix(args.unix)
+        else:
+            listener = await server.start(args.host, args.port)
+        async with listener:
+            await listener.serve_forever()
+
+    asyncio.run(serve_forever())
+
+
+if __name__ == '__main__':
+    main()
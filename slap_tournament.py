@@ -0,0 +1,114 @@
+'''Round-robin tournaments between computer-opponent policies, played on every core of the machine.
+
+Every policy plays every other policy in both seats (as the 'player', who goes first and loses ties, and as the
+'computer'). Each match is split into chunks of games, the chunks are handed to a process pool, and the results
+are streamed back as each chunk finishes. Each chunk is seeded from the tournament seed and the chunk's place in
+the schedule, so a tournament gives the same totals no matter how many processes run it or in which order the
+chunks finish.
+
+Run 'python slap_tournament.py' to rank a small ladder of difficulty settings.'''
+
+import multiprocessing
+
+from W200proj1 import WAIT_TIME, RandomStream, ReactionTimePolicy, simulate
+
+
+def chunk_seed(seed, match, chunk):
+    '''Returns the RandomStream for one chunk of games. Its key is the chunk's place in the schedule, so
+        neighbouring chunks get unrelated streams and no two chunks share one.'''
+    return RandomStream(seed, (match, chunk))
+
+
+def play_chunk(task):
+    '''Plays one chunk of a match in a worker process and returns (player_name, computer_name, SimulationResult).'''
+    player_name, player_policy, computer_name, computer_policy, n_games, seed, wait_time, max_turns = task
+    result = simulate(n_games, seed, player_policy, computer_policy, wait_time, max_turns)
+    return player_name, computer_name, result
+
+
+class Standing:
+    '''Running totals for one policy in a tournament.'''
+
+    def __init__(self, name):
+        self.name = name
+        self.games = 0
+        self.wins = 0
+        self.unfinished = 0
+
+    def win_rate(self):
+        return self.wins / self.games if self.games else 0.0
+
+    def __repr__(self):
+        return '{self.name}: {self.wins}/{self.games} ({rate:.1%})'.format(self=self, rate=self.win_rate())
+
+
+class Tournament:
+    '''A round-robin between named policies. policies is a dict of name -> SlapPolicy; the policies have to be
+        picklable so they can be sent to the worker processes.'''
+
+    def __init__(self, policies, games_per_match=1000, chunk_size=250, seed=0, wait_time=WAIT_TIME,
+                 max_turns=10000, processes=None):
+        self.policies = dict(policies)
+        self.games_per_match = games_per_match
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.wait_time = wait_time
+        self.max_turns = max_turns
+        self.processes = processes
+        self.standings = {name: Standing(name) for name in self.policies}
+
+    def matches(self):
+        '''Returns every (player_name, computer_name) pairing, with each pair of policies meeting in both seats.'''
+        names = list(self.policies)
+        return [(a, b) for a in names for b in names if a != b]
+
+    def tasks(self):
+        '''Yields one task per chunk of games, in schedule order.'''
+        for match, (player_name, computer_name) in enumerate(self.matches()):
+            for chunk, start in enumerate(range(0, self.games_per_match, self.chunk_size)):
+                n_games = min(self.chunk_size, self.games_per_match - start)
+                yield (player_name, self.policies[player_name], computer_name, self.policies[computer_name],
+                       n_games, chunk_seed(self.seed, match, chunk), self.wait_time, self.max_turns)
+
+    def record(self, player_name, computer_name, result):
+        '''Adds a finished chunk to the standings.'''
+        for name, side in ((player_name, 'player'), (computer_name, 'computer')):
+            standing = self.standings[name]
+            standing.games += result.games
+            standing.wins += result.wins[side]
+            standing.unfinished += result.unfinished
+
+    def run(self):
+        '''Plays the tournament on a process pool and yields (player_name, computer_name, SimulationResult) for
+            each chunk as soon as it finishes. The standings are up to date after every yielded chunk.'''
+        with multiprocessing.Pool(self.processes) as pool:
+            for player_name, computer_name, result in pool.imap_unordered(play_chunk, self.tasks()):
+                self.record(player_name, computer_name, result)
+                yield player_name, computer_name, result
+
+    def play(self):
+        '''Plays the whole tournament and returns the final ranking.'''
+        for chunk in self.run():
+            pass
+        return self.ranking()
+
+    def ranking(self):
+        '''Returns the standings sorted from the highest win rate to the lowest.'''
+        return sorted(self.standings.values(), key=lambda standing: standing.win_rate(), reverse=True)
+
+
+def difficulty_ladder(levels=5, fastest=0.35, slowest=0.95):
+    '''Returns named ReactionTimePolicy settings from fast and careful to slow and sloppy.'''
+    policies = {}
+    for level in range(levels):
+        step = level / max(levels - 1, 1)
+        mean = fastest + (slowest - fastest) * step
+        policies['level{}'.format(level + 1)] = ReactionTimePolicy(mean, mean / 4, miss_rate=0.05 + 0.15 * step,
+                                                                    false_slap_rate=0.01 * step)
+    return policies
+
+
+if __name__ == '__main__':
+    tournament = Tournament(difficulty_ladder(), games_per_match=2000)
+    for standing in tournament.play():
+        print(standing)
@@ -0,0 +1,201 @@
+'''Plays many games of Slap at the same time with NumPy. Every game's decks are rows of rank codes in NumPy
+arrays, and each pass of the main loop plays one turn in every game that is still going, so dealing, the
+Double/Sandwhich checks and handing the pile to the slap winner are done for the whole batch at once.
+The rules are the same as SlapEngine in W200proj1: the player goes first, the pile goes to the winner of
+the slap and is shuffled into their deck, a wrong slap burns three cards to the bottom of the pile (or loses
+the game with fewer than three), and whoever has no cards at the start of their turn loses.
+
+Needs NumPy (pip install numpy). The rest of the game does not.'''
+
+import numpy as np
+
+from W200proj1 import RANKS
+
+# Index of each side in the result arrays.
+PLAYER = 0
+COMPUTER = 1
+# Winner value for games stopped at max_turns.
+NO_WINNER = -1
+
+# Number of cards in a full deck. Every deck and the discard pile are stored in rows this long, because no
+# single pile can ever hold more than every card.
+DECK_SIZE = 4 * len(RANKS)
+
+
+class BatchResult:
+    '''The arrays returned by simulate_batch. For game i: winners[i] is PLAYER, COMPUTER or NO_WINNER,
+        lengths[i] is the number of cards drawn, slaps[i] holds the number of piles won by the player and by
+        the computer, and wrong_slaps[i] holds the number of wrong slaps made by each.'''
+
+    def __init__(self, winners, lengths, slaps, wrong_slaps):
+        self.winners = winners
+        self.lengths = lengths
+        self.slaps = slaps
+        self.wrong_slaps = wrong_slaps
+
+    def win_rate(self, side=PLAYER):
+        '''Returns the fraction of games that side won.'''
+        return float(np.mean(self.winners == side)) if len(self.winners) else 0.0
+
+    def __repr__(self):
+        return 'BatchResult(games={}, player_wins={}, computer_wins={}, unfinished={})'.format(
+            len(self.winners), int(np.sum(self.winners == PLAYER)), int(np.sum(self.winners == COMPUTER)),
+            int(np.sum(self.winners == NO_WINNER)))
+
+
+def spawn_generators(seed, n):
+    '''Returns n independent NumPy generators made from seed, one for each worker or batch. The same seed
+        always gives the same generators, and their streams do not overlap.'''
+    return [np.random.default_rng(child) for child in np.random.SeedSequence(seed).spawn(n)]
+
+
+def shuffled_decks(n_decks, rng):
+    '''Shuffles n_decks full decks in one go and returns them as an (n_decks, DECK_SIZE) array of rank codes,
+        top card first. rng is a NumPy generator or a seed. A row can be turned into a Deck with
+        W200proj1.Deck.from_codes.'''
+    rng = np.random.default_rng(rng)
+    # A random permutation of card positions, turned into rank codes the same way Deck() lays out its cards.
+    order = np.argsort(rng.random((n_decks, DECK_SIZE)), axis=1)
+    return (order % len(RANKS)).astype(np.int8)
+
+
+def deal(n_games, rng):
+    '''Shuffles n_games full decks and deals them out like Slap does. Returns the decks as an array of shape
+        (n_games, 2, DECK_SIZE) with each side's 26 cards at the start of its row.'''
+    cards = shuffled_decks(n_games, rng)
+
+    decks = np.zeros((n_games, 2, DECK_SIZE), dtype=np.int8)
+    half = DECK_SIZE // 2
+    decks[:, PLAYER, :half] = cards[:, 0::2]
+    decks[:, COMPUTER, :half] = cards[:, 1::2]
+    return decks
+
+
+def _per_game(value, n_games):
+    '''Turns a scalar or an array with one value per game into a float array with one value per game.'''
+    return np.broadcast_to(np.asarray(value, dtype=np.float64), (n_games,))
+
+
+def simulate_batch(n_games, seed=None, player_win_prob=0.5, player_false_slap_rate=0.0,
+                   computer_false_slap_rate=0.0, max_turns=10000):
+    '''Plays n_games games in lockstep and returns a BatchResult.
+
+        player_win_prob is the chance the player wins a slap event instead of the computer. The false slap rates
+        are the chance a side slaps at the wrong time at the start of each of its turns. Each of these can be a
+        single number or an array with one value per game, so a whole parameter sweep can run as one batch.
+        The same seed always gives the same result; seed can also be a NumPy generator, such as one from
+        spawn_generators. Games still going after max_turns draws are stopped and
+        get NO_WINNER.'''
+    rng = np.random.default_rng(seed)
+    win_prob = _per_game(player_win_prob, n_games)
+    false_rates = np.stack([_per_game(player_false_slap_rate, n_games),
+                            _per_game(computer_false_slap_rate, n_games)], axis=1)
+
+    decks = deal(n_games, rng)
+    heads = np.zeros((n_games, 2), dtype=np.int64)
+    counts = np.full((n_games, 2), DECK_SIZE // 2, dtype=np.int64)
+    pile = np.zeros((n_games, DECK_SIZE), dtype=np.int8)
+    pile_len = np.zeros(n_games, dtype=np.int64)
+    turn = np.zeros(n_games, dtype=np.int64)
+
+    winners = np.full(n_games, NO_WINNER, dtype=np.int8)
+    lengths = np.zeros(n_games, dtype=np.int64)
+    slaps = np.zeros((n_games, 2), dtype=np.int64)
+    wrong_slaps = np.zeros((n_games, 2), dtype=np.int64)
+    active = np.ones(n_games, dtype=bool)
+    positions = np.arange(DECK_SIZE)
+
+    for i in range(max_turns):
+        games = np.flatnonzero(active)
+        if len(games) == 0:
+            break
+        sides = turn[games]
+
+        # Whoever has no cards at the start of their turn has lost.
+        out = counts[games, sides] == 0
+        if out.any():
+            winners[games[out]] = 1 - sides[out]
+            active[games[out]] = False
+            games = games[~out]
+            sides = sides[~out]
+
+        # Wrong slaps at the start of the turn.
+        slapped = rng.random(len(games)) < false_rates[games, sides]
+        if slapped.any():
+            s_games = games[slapped]
+            s_sides = sides[slapped]
+            wrong_slaps[s_games, s_sides] += 1
+
+            # Sides with fewer than three cards lose the game.
+            short = counts[s_games, s_sides] < 3
+            counts[s_games[short], s_sides[short]] = 0
+
+            # Everyone else burns their top three cards to the bottom of the pile. The third card burned ends
+            # up at the very bottom, like Deck.lose_cards.
+            b_games = s_games[~short]
+            b_sides = s_sides[~short]
+            if len(b_games):
+                b_heads = heads[b_games, b_sides]
+                pile[b_games, 3:] = pile[b_games, :-3]
+                for k in range(3):
+                    pile[b_games, 2 - k] = decks[b_games, b_sides, (b_heads + k) % DECK_SIZE]
+                heads[b_games, b_sides] = (b_heads + 3) % DECK_SIZE
+                counts[b_games, b_sides] -= 3
+                pile_len[b_games] += 3
+
+            # A side left with no cards loses before it can draw.
+            out = counts[games, sides] == 0
+            if out.any():
+                winners[games[out]] = 1 - sides[out]
+                active[games[out]] = False
+                games = games[~out]
+                sides = sides[~out]
+
+        # Draws the top card onto the discard pile.
+        g_heads = heads[games, sides]
+        pile[games, pile_len[games]] = decks[games, sides, g_heads]
+        heads[games, sides] = (g_heads + 1) % DECK_SIZE
+        counts[games, sides] -= 1
+        pile_len[games] += 1
+        lengths[games] += 1
+
+        # Compares the new top card against positions -2 (Double) and -3 (Sandwhich).
+        g_len = pile_len[games]
+        top = pile[games, g_len - 1]
+        double = (g_len > 1) & (pile[games, np.maximum(g_len - 2, 0)] == top)
+        sandwhich = (g_len > 2) & (pile[games, np.maximum(g_len - 3, 0)] == top)
+        event = double | sandwhich
+        if event.any():
+            _award_piles(games[event], rng, win_prob, decks, heads, counts, pile, pile_len, slaps, positions)
+
+        turn[games] = 1 - sides
+
+    return BatchResult(winners, lengths, slaps, wrong_slaps)
+
+
+def _award_piles(games, rng, win_prob, decks, heads, counts, pile, pile_len, slaps, positions):
+    '''Decides who wins each slap event in games, then adds each discard pile to the bottom of the winner's
+        deck, shuffles that deck and empties the pile.'''
+    sides = np.where(rng.random(len(games)) < win_prob[games], PLAYER, COMPUTER)
+    slaps[games, sides] += 1
+
+    # Lines up each winner's deck from its top card, then puts the pile after it.
+    deck_len = counts[games, sides]
+    g_pile_len = pile_len[games]
+    order = (heads[games, sides][:, None] + positions) % DECK_SIZE
+    combined = np.take_along_axis(decks[games, sides], order, axis=1)
+    pile_pos = positions - deck_len[:, None]
+    from_pile = (pile_pos >= 0) & (pile_pos < g_pile_len[:, None])
+    pile_cards = np.take_along_axis(pile[games], np.clip(pile_pos, 0, DECK_SIZE - 1), axis=1)
+    combined[from_pile] = pile_cards[from_pile]
+
+    # Shuffles only the real cards in each row by sorting random keys, with the empty slots sorted last.
+    total = deck_len + g_pile_len
+    keys = rng.random(combined.shape)
+    keys[positions >= total[:, None]] = 2.0
+    combined = np.take_along_axis(combined, np.argsort(keys, axis=1), axis=1)
+
+    decks[games, sides] = combined
+    heads[games, sides] = 0
+    counts[games, sides] = total
+    pile_len[games] = 0
@@ -0,0 +1,405 @@
+'''Checks for the parts of Slap that are easy to get subtly wrong. Run with 'python -m pytest' or
+'python -m unittest test_slap'.'''
+
+import asyncio
+import os
+import pickle
+import random
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from W200proj1 import (CARDS, DEFAULT_RULES, EVENT_DRAW, HOUSE_RULES, FixedReactionPolicy, Instructions,
+                       RandomReactionPolicy, RandomStream, Renderer, Slap, SlapEngine, SlapMatcher, SlapPolicy, StateHash, simulate)
+from bench_slap import FakeScreen
+from slap_replay import GameRecorder, Recording, RecordingReader, ReplayError, record_games, replay
+from slap_server import SlapServer
+
+# slap_vectorized needs NumPy, which the rest of the game does not.
+try:
+    import numpy as np
+    import slap_vectorized
+except ImportError:
+    np = None
+
+
+def sloppy(low=0.2):
+    '''A policy that is slow, sometimes misses, and often slaps at the wrong time, so games have wrong slaps.'''
+    return RandomReactionPolicy(low, 0.9, miss_rate=0.2, false_slap_rate=0.1)
+
+
+class RandomStreamTest(unittest.TestCase):
+
+    def test_root_matches_random(self):
+        expected = random.Random(12345)
+        stream = RandomStream(12345)
+        self.assertEqual([stream.random() for i in range(100)], [expected.random() for i in range(100)])
+        self.assertEqual(stream.getrandbits(64), expected.getrandbits(64))
+
+    def test_spawn_order_is_repeatable(self):
+        first = RandomStream(7)
+        second = RandomStream(7)
+        # Drawing from a parent does not change the children it spawns.
+        first.random()
+        for stream in (first, second):
+            stream.spawn(2)
+        children = [child.getrandbits(64) for child in first.spawn(3)]
+        self.assertEqual(children, [child.getrandbits(64) for child in second.spawn(3)])
+        self.assertEqual(len(set(children)), 3)
+        self.assertEqual([child.key for child in RandomStream(7).spawn(1)[0].spawn(2)], [(0, 0), (0, 1)])
+        self.assertNotEqual(RandomStream(7).spawn(1)[0].getrandbits(64), RandomStream(8).spawn(1)[0].getrandbits(64))
+
+    def test_pickle_keeps_state_and_spawned(self):
+        stream = RandomStream(99).spawn(2)[1]
+        stream.spawn(3)
+        for i in range(10):
+            stream.random()
+        copy = pickle.loads(pickle.dumps(stream))
+        self.assertEqual((copy.entropy, copy.key, copy.spawned), (stream.entropy, stream.key, 3))
+        self.assertEqual(copy.random(), stream.random())
+        self.assertEqual([child.random() for child in copy.spawn(2)], [child.random() for child in stream.spawn(2)])
+
+
+class SimulateTest(unittest.TestCase):
+
+    def test_same_seed_same_result(self):
+        # The global random module is in a different state for each run; seeded games must not depend on it.
+        results = []
+        for global_seed in (1, 2):
+            random.seed(global_seed)
+            results.append(repr(simulate(50, seed=1, player_policy=sloppy(), computer_policy=sloppy(0.1))))
+        self.assertEqual(results[0], results[1])
+
+    def test_deal_depends_only_on_seed(self):
+        random.seed(1)
+        first = SlapEngine(seed=9)
+        random.seed(2)
+        second = SlapEngine(seed=9)
+        self.assertEqual(first.player.to_bytes(), second.player.to_bytes())
+        self.assertEqual(first.computer.to_bytes(), second.computer.to_bytes())
+
+
+class SlapMatcherTest(unittest.TestCase):
+
+    def expected(self, rules, pile):
+        '''Checks pile against each rule directly, the slow way.'''
+        if len(pile)<2:
+            return None
+        for rule in rules:
+            codes = [pile[position].code if -len(pile) <= position < len(pile) else None
+                     for position in rule.positions]
+            if rule.matches(codes):
+                return rule.name
+        return None
+
+    def test_table_matches_rules(self):
+        rng = random.Random(1)
+        for rules in (DEFAULT_RULES, HOUSE_RULES):
+            matcher = SlapMatcher(rules)
+            for i in range(5000):
+                pile = [CARDS[rng.randrange(len(CARDS))] for card in range(rng.randrange(6))]
+                self.assertEqual(matcher.match(pile), self.expected(rules, pile), pile)
+
+
+class SlapOddsTest(unittest.TestCase):
+
+    def brute_force(self, engine):
+        '''Tries every card still in the two decks on top of the pile and returns the fraction that set off a slap
+            event.'''
+        unseen = list(engine.player.deck) + list(engine.computer.deck)
+        if not unseen or not engine.discard_pile.deck:
+            return 0.0
+        pile = list(engine.discard_pile.deck)
+        hits = sum(1 for card in unseen if engine.matcher.match(pile + [card]) is not None)
+        return hits / len(unseen)
+
+    def test_next_chance_matches_brute_force(self):
+        for seed in range(30):
+            rules = HOUSE_RULES if seed % 2 else DEFAULT_RULES
+            engine = SlapEngine(sloppy(), sloppy(0.1), seed=seed, rules=rules, odds=True)
+            while engine.winner is None and engine.turns<1000:
+                engine.step()
+                self.assertAlmostEqual(engine.odds.next_chance, self.brute_force(engine),
+                                       msg='seed {} turn {}'.format(seed, engine.turns))
+
+
+class StateHashTest(unittest.TestCase):
+
+    def test_incremental_hash_equals_full_rehash(self):
+        wrong_slaps = 0
+        for seed in range(60):
+            rules = HOUSE_RULES if seed % 2 else DEFAULT_RULES
+            engine = SlapEngine(sloppy(), sloppy(0.1), seed=seed, rules=rules, on_repeat='count')
+            state_hash = engine.state_hash
+            while engine.winner is None and engine.turns<1500:
+                engine.step()
+                key = state_hash.key(engine.player_turn)
+                fresh = StateHash(engine)
+                self.assertEqual(fresh.hashes, state_hash.hashes, 'seed {} turn {}'.format(seed, engine.turns))
+                self.assertEqual(fresh.key(engine.player_turn), key)
+                # The fresh hash only checks; it should not keep listening.
+                engine.listeners.remove(fresh)
+            wrong_slaps += sum(engine.wrong_slaps.values())
+        self.assertGreater(wrong_slaps, 0)
+
+
+class ReplayTest(unittest.TestCase):
+
+    def test_round_trip_with_house_rules(self):
+        fd, path = tempfile.mkstemp(suffix='.slpg')
+        os.close(fd)
+        try:
+            result = record_games(path, 100, seed=3, player_policy=sloppy(), computer_policy=sloppy(0.1),
+                                  rules=HOUSE_RULES, on_repeat='draw')
+            with RecordingReader(path) as reader:
+                recordings = list(reader)
+                self.assertEqual(len(recordings), result.games)
+                for recording in recordings:
+                    # The recording names the rules it was played with.
+                    self.assertIs(recording.rules, HOUSE_RULES)
+                    engine = replay(recording)
+                    self.assertEqual(engine.winner, recording.winner)
+                    self.assertEqual(engine.turns, sum(1 for event in recording if event[0] == EVENT_DRAW))
+                del recordings, recording
+        finally:
+            os.remove(path)
+
+    def test_custom_rules_must_be_given(self):
+        rules = HOUSE_RULES[:1]
+        engine = SlapEngine(sloppy(), sloppy(0.1), seed=4, recorder=GameRecorder(), rules=rules)
+        engine.play(10000)
+        recording = Recording(engine.recorder.to_bytes(engine))
+        self.assertIsNone(recording.rules)
+        with self.assertRaises(ReplayError):
+            replay(recording)
+        self.assertEqual(replay(recording, rules).winner, engine.winner)
+
+
+def play_batch_game(seed, player_win_prob=0.5, false_slap_rates=(0.0, 0.0), max_turns=10000):
+    '''Plays the game simulate_batch(1, seed, ...) plays, one card at a time with lists, drawing the same random
+        numbers in the same order. Returns (winner, length, slaps, wrong slaps) like row 0 of its BatchResult.'''
+    rng = np.random.default_rng(seed)
+    cards = [int(code) for code in slap_vectorized.shuffled_decks(1, rng)[0]]
+    decks = [cards[0::2], cards[1::2]]
+    pile = []
+    winner = slap_vectorized.NO_WINNER
+    length = 0
+    slaps = [0, 0]
+    wrong_slaps = [0, 0]
+    side = slap_vectorized.PLAYER
+    for i in range(max_turns):
+        if not decks[side]:
+            winner = 1 - side
+            break
+        if rng.random(1)[0] < false_slap_rates[side]:
+            wrong_slaps[side] += 1
+            if len(decks[side])<3:
+                decks[side] = []
+            else:
+                # The third card burned ends up at the bottom of the pile.
+                pile = decks[side][2::-1] + pile
+                del decks[side][:3]
+            if not decks[side]:
+                winner = 1 - side
+                break
+        pile.append(decks[side].pop(0))
+        length += 1
+        if (len(pile)>1 and pile[-2] == pile[-1]) or (len(pile)>2 and pile[-3] == pile[-1]):
+            slapper = slap_vectorized.PLAYER if rng.random(1)[0] < player_win_prob else slap_vectorized.COMPUTER
+            slaps[slapper] += 1
+            combined = decks[slapper] + pile
+            keys = rng.random((1, slap_vectorized.DECK_SIZE))[0]
+            keys[len(combined):] = 2.0
+            decks[slapper] = [combined[j] for j in np.argsort(keys)[:len(combined)]]
+            pile = []
+        side = 1 - side
+    return winner, length, slaps, wrong_slaps
+
+
+@unittest.skipIf(np is None, 'needs NumPy')
+class VectorizedTest(unittest.TestCase):
+
+    def test_single_games_match_list_model(self):
+        # High wrong-slap rates make plenty of burns, and decks that empty and refill.
+        for seed in range(40):
+            for rates in ((0.0, 0.0), (0.1, 0.05), (0.3, 0.3)):
+                result = slap_vectorized.simulate_batch(1, seed, 0.4, rates[0], rates[1], max_turns=3000)
+                got = (int(result.winners[0]), int(result.lengths[0]), result.slaps[0].tolist(),
+                       result.wrong_slaps[0].tolist())
+                self.assertEqual(got, play_batch_game(seed, 0.4, rates, 3000), 'seed {} rates {}'.format(seed, rates))
+
+    def test_same_seed_same_batch(self):
+        first = slap_vectorized.simulate_batch(50, seed=2, player_false_slap_rate=0.05)
+        second = slap_vectorized.simulate_batch(50, seed=2, player_false_slap_rate=0.05)
+        for name in ('winners', 'lengths', 'slaps', 'wrong_slaps'):
+            np.testing.assert_array_equal(getattr(first, name), getattr(second, name))
+
+    def test_matches_engine_statistics(self):
+        # Two sides slapping at uniform times within the wait time and never missing each win half the slap
+        # events, which is what the batch simulator's player_win_prob=0.5 plays.
+        n = 1000
+        engines = []
+        for seed in range(n):
+            engine = SlapEngine(RandomReactionPolicy(0, 1, false_slap_rate=0.02),
+                                RandomReactionPolicy(0, 1, false_slap_rate=0.02), seed=seed)
+            engine.play(10000)
+            engines.append(engine)
+        batch = slap_vectorized.simulate_batch(n, seed=1, player_win_prob=0.5, player_false_slap_rate=0.02,
+                                               computer_false_slap_rate=0.02)
+        pairs = {'length': ([engine.turns for engine in engines], batch.lengths),
+                 'player wins': ([engine.winner == 'player' for engine in engines],
+                                 batch.winners == slap_vectorized.PLAYER),
+                 'slaps': ([sum(engine.slaps.values()) for engine in engines], batch.slaps.sum(axis=1)),
+                 'wrong slaps': ([sum(engine.wrong_slaps.values()) for engine in engines],
+                                 batch.wrong_slaps.sum(axis=1))}
+        for name, (expected, got) in pairs.items():
+            expected = np.asarray(expected, dtype=float)
+            got = np.asarray(got, dtype=float)
+            # The means have to agree to within four standard errors of their difference.
+            error = np.sqrt(expected.var() / n + got.var() / n)
+            self.assertLess(abs(expected.mean() - got.mean()), 4 * error, name)
+
+
+class ScriptedScreen(FakeScreen):
+    '''A FakeScreen that also hands out scripted key presses, one per getch call, and then -1 (no key).'''
+
+    def __init__(self, keys=''):
+        super().__init__()
+        self.keys = [ord(key) for key in keys]
+
+    def getch(self):
+        return self.keys.pop(0) if self.keys else -1
+
+    def nodelay(self, flag):
+        pass
+
+    def clear(self):
+        self.rows = {}
+
+
+def run_game(game, keys):
+    '''Plays game.play() without a terminal, with keys typed before it starts. Returns the closing message.'''
+    game.screen = ScriptedScreen(keys)
+    game.renderer = Renderer(game.screen, update=lambda: None)
+    game.PLAYER_PAUSE = game.COMPUTER_PAUSE = game.SANDWHICH_PAUSE = 0
+    # play() watches stdin for keys; a pipe that nobody writes to stands in for the terminal.
+    read_end, write_end = os.pipe()
+    try:
+        with open(read_end) as stdin, mock.patch('sys.stdin', stdin):
+            return asyncio.run(asyncio.wait_for(game.play(), 5))
+    finally:
+        os.close(write_end)
+
+
+def race(game, keys, computer_time=0.0, then=None):
+    '''Runs one slap race of game with keys ((key, offset in ns from when the card landed) pairs) already read, and
+        the computer slapping computer_time seconds after the card landed, then awaits then() if given. Returns the
+        race's result and the keys left in the queue at the end, as (key, offset) pairs.'''
+    game.engine.policies['computer'] = FixedReactionPolicy(computer_time)
+
+    async def run():
+        game.keys = asyncio.Queue()
+        game.late_until = 0
+        landed = time.perf_counter_ns()
+        for key, offset in keys:
+            game.keys.put_nowait((ord(key), landed + offset))
+        result = await game.slap_race('Double', landed)
+        if then is not None:
+            await then()
+        left = []
+        while not game.keys.empty():
+            c, stamp = game.keys.get_nowait()
+            left.append((chr(c), stamp - landed))
+        return result, left
+
+    return asyncio.run(asyncio.wait_for(run(), 5))
+
+
+class SlapGameTest(unittest.TestCase):
+
+    def test_loss_to_wrong_slaps_sets_winner(self):
+        # Eight wrong slaps leave the player two cards and the ninth loses the game. max_turns=0 would make the
+        # end of the turn a draw, but a lost game is never a draw.
+        game = Slap(computer_policy=SlapPolicy(), record_path=os.devnull, max_turns=0, seed=5)
+        self.assertEqual(run_game(game, 's' * 9 + 'x'), 'Sorry player, you lost')
+        engine = game.engine
+        self.assertEqual(engine.winner, 'computer')
+        self.assertFalse(engine.drawn)
+        self.assertEqual(engine.wrong_slaps['player'], 9)
+
+        recording = Recording(engine.recorder.to_bytes(engine))
+        self.assertEqual(recording.winner, 'computer')
+        self.assertEqual(replay(recording).winner, 'computer')
+
+    def test_max_turns_draw_sets_drawn(self):
+        game = Slap(computer_policy=SlapPolicy(), max_turns=1, seed=5)
+        self.assertEqual(run_game(game, 'd'), 'The game is a draw')
+        self.assertTrue(game.engine.drawn)
+        self.assertIsNone(game.engine.winner)
+
+    def test_race_keeps_keys_typed_ahead(self):
+        game = Slap(seed=5)
+        # The d was typed before the card landed and the x after the computer slapped; both are left for the
+        # player's turn, in order.
+        result, left = race(game, [('d', -10), ('x', 10), ('d', 20)])
+        self.assertEqual(result, ('computer', 0.0))
+        self.assertEqual(left, [('d', -10), ('x', 10), ('d', 20)])
+
+    def test_race_player_slap_and_quit(self):
+        game = Slap(seed=5)
+        result, left = race(game, [('d', -10), ('s', 1000)], computer_time=0.5)
+        self.assertEqual(result, ('player', 1e-6))
+        self.assertEqual(left, [('d', -10)])
+        # A q typed before the card landed still quits.
+        self.assertEqual(race(game, [('q', -10)])[0], ('quit', None))
+
+    def test_late_slap_is_not_a_wrong_slap(self):
+        game = Slap(seed=5)
+        game.screen = ScriptedScreen()
+        game.renderer = Renderer(game.screen, update=lambda: None)
+        # The s comes just after the computer won the race, then the player draws on their turn.
+        result, left = race(game, [('s', 10), ('d', 20)], then=game.player_turn)
+        self.assertEqual(result, ('computer', 0.0))
+        self.assertEqual(left, [])
+        self.assertEqual(game.engine.wrong_slaps['player'], 0)
+        self.assertEqual(game.engine.turns, 1)
+
+    def test_instructions_explain_house_rules(self):
+        text = ''.join(Instructions(None, HOUSE_RULES).instructions)
+        for rule in HOUSE_RULES[2:]:
+            self.assertIn(rule.name, text)
+        self.assertNotIn('house rules', ''.join(Instructions(None).instructions))
+
+
+class ServerTest(unittest.TestCase):
+
+    def test_seed_is_only_sent_at_the_end(self):
+        async def session():
+            server = SlapServer(seed=7)
+            listener = await server.start()
+            host, port = listener.sockets[0].getsockname()[:2]
+            async with listener:
+                first = await asyncio.open_connection(host, port)
+                second = await asyncio.open_connection(host, port)
+                first[1].write(b'JOIN\n')
+                second[1].write(b'JOIN\n')
+                seat = await first[0].readline()
+                second[1].write(b'QUIT\n')
+                lines = []
+                while not lines or not lines[-1].startswith(b'END'):
+                    lines.append(await first[0].readline())
+                for reader, writer in (first, second):
+                    writer.close()
+                return seat, lines[-1]
+
+        seat, end = asyncio.run(asyncio.wait_for(session(), 5))
+        words = seat.split()
+        self.assertEqual(len(words), 2)
+        self.assertEqual(words[0], b'SEAT')
+        # The other seat quit, so this one won.
+        self.assertEqual(end.split(), [b'END', words[1], b'forfeit', str(RandomStream(7).getrandbits(63)).encode()])
+
+
+if __name__ == '__main__':
+    unittest.main()